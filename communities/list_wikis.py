@@ -2,23 +2,16 @@ from typing import Callable
 
 import requests
 from airium import Airium
-from pywikibot import Page, Site
-from pywikibot.pagegenerators import PreloadingGenerator
-from wikitextparser import parse
 
-from communities.wiki_db import get_item_id_from_wiki, get_wiki_dict
+from communities.wiki_db import get_item_id_from_wiki
 from utils.general_utils import headers
-from utils.wiki_scanner import run_wiki_scanner_query, fetch_all_mh_wikis
-
-wiki_dict = None
+from utils.wiki_catalog import get_wiki_catalog
+from utils.wiki_scanner import run_wiki_scanner_query
 
 TABLE_CLASSES = "wikitable sortable mw-collapsible mw-collapsed"
 
 def get_wiki_name_column(db: str) -> str:
-    global wiki_dict
-    if wiki_dict is None:
-        wiki_dict = get_wiki_dict()
-    wiki = wiki_dict[db]
+    wiki = get_wiki_catalog()[db]
     item_id = get_item_id_from_wiki(wiki)
     if item_id is None:
         item = ""
@@ -102,7 +95,7 @@ def list_wikis_by_meta_referrals():
     page = requests.get("https://meta.miraheze.org/wiki/Special:Analytics", headers=headers)
     soup = BeautifulSoup(page.content, "html.parser")
     section = soup.find('div', attrs={'id': 'mw-htmlform-matomoanalytics-labels-website'})
-    url_to_wiki_db = dict((w.url.replace("https://", ""), w.db_name) for w in fetch_all_mh_wikis())
+    catalog = get_wiki_catalog()
     referrals: list[tuple[str, str]] = []
     for wiki in section.find_all('div', attrs={'class': 'oo-ui-fieldLayout-body'}):
         children = list(wiki.children)
@@ -111,9 +104,10 @@ def list_wikis_by_meta_referrals():
         count = children[1].text.strip()
         if not count.isdigit():
             continue
-        if url not in url_to_wiki_db:
+        wiki = catalog.by_url(url)
+        if wiki is None:
             continue
-        referrals.append((url_to_wiki_db[url], count))
+        referrals.append((wiki.db_name, count))
 
     a = Airium(base_indent="")
     with a.table(klass="wikitable"):
@@ -160,6 +154,9 @@ def list_skins_by_popularity():
 
 
 def update_wiki_list_pages():
+    from pywikibot import Page, Site
+    from pywikibot.pagegenerators import PreloadingGenerator
+    from wikitextparser import parse
     pages: dict[str, Callable[[], str]] = {
         'List_of_wikis_by_active_users': list_wikis_by_active_users,
         'List_of_wikis_by_article_count': list_wikis_by_article_count,
@@ -12,7 +12,8 @@ from wikibaseintegrator.wbi_helpers import search_entities
 from communities.wiki_db import insert_item_id_for_wiki, db_fetch
 from communities.wbi_helper import preload_items, get_wbi
 from utils.general_utils import MirahezeWiki, throttle
-from utils.wiki_scanner import fetch_all_mh_wikis, run_wiki_scanner_query
+from utils.wiki_catalog import get_wiki_catalog
+from utils.wiki_scanner import run_wiki_scanner_query
 from wiki_scanners.extension_statistics import get_wiki_extension_statistics, WikiExtensionStatistics
 from wiki_scanners.site_statistics import get_wiki_site_statistics, WikiSiteStatistics
 
@@ -56,7 +57,7 @@ def find_entity_by_exact_label(label: str, entity_type: str = 'item') -> str | N
 
 def get_all_stats() -> dict[str, MirahezeWikiStats]:
     result: dict[str, MirahezeWikiStats] = {}
-    wikis = fetch_all_mh_wikis()
+    wikis = get_wiki_catalog().values()
     ext_statistics = get_wiki_extension_statistics(read_only=True)
     site_statistics = get_wiki_site_statistics(read_only=True)
     for wiki in wikis:
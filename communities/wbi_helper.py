@@ -1,17 +1,20 @@
 from functools import cache
-from typing import Generator
+from typing import Generator, TYPE_CHECKING
 
-from wikibaseintegrator import WikibaseIntegrator, wbi_login
-from wikibaseintegrator.entities import BaseEntity, ItemEntity
-from wikibaseintegrator.wbi_config import config as wbi_config
-from wikibaseintegrator.wbi_helpers import generate_entity_instances
-
-from communities.bot_oauth import bot_passwords
 from utils.general_utils import user_agent
 
+# wikibaseintegrator is slow to import and get_wbi logs in, so neither happens
+# until a function in this module is actually called.
+if TYPE_CHECKING:
+    from wikibaseintegrator import WikibaseIntegrator
+    from wikibaseintegrator.entities import ItemEntity
+
 
 @cache
-def get_wbi():
+def get_wbi() -> 'WikibaseIntegrator':
+    from wikibaseintegrator import WikibaseIntegrator, wbi_login
+    from wikibaseintegrator.wbi_config import config as wbi_config
+    from communities.bot_oauth import bot_passwords
     wbi_config['MEDIAWIKI_API_URL'] = 'https://communities.miraheze.org/w/api.php'
     wbi_config['MEDIAWIKI_REST_URL'] = 'https://communities.miraheze.org/w/api.php'
     wbi_config['WIKIBASE_URL'] = ''
@@ -25,7 +28,10 @@ def get_wbi():
 
 
 def preload_items(titles: list[str],
-                  wbi: WikibaseIntegrator = get_wbi()) -> Generator[tuple[str, ItemEntity], None, None]:
+                  wbi: 'WikibaseIntegrator | None' = None) -> Generator[tuple[str, 'ItemEntity'], None, None]:
+    from wikibaseintegrator.wbi_helpers import generate_entity_instances
+    if wbi is None:
+        wbi = get_wbi()
     size = 50
     chunked = [titles[i:i + size] for i in range(0, len(titles), size)]
     for chunk in chunked:
@@ -1,12 +1,9 @@
 from functools import cache
 
-from pywikibot import Site
-from pywikibot.pagegenerators import GeneratorFactory
-
 from communities.wbi_helper import preload_items
 from utils.db_utils import make_conn, db_dir
 from utils.general_utils import MirahezeWiki
-from utils.wiki_scanner import fetch_all_mh_wikis
+from utils.wiki_catalog import get_wiki_catalog, WikiCatalog
 
 communities_wiki_db = db_dir / "communities.sqlite"
 
@@ -75,11 +72,13 @@ def replace_wiki_list(wikis: list[tuple[MirahezeWiki, str]]):
     conn.commit()
 
 
-def get_wiki_dict() -> dict[str, MirahezeWiki]:
-    return dict((w.db_name, w) for w in fetch_all_mh_wikis())
+def get_wiki_dict() -> WikiCatalog:
+    return get_wiki_catalog()
 
 
 def update_local_db():
+    from pywikibot import Site
+    from pywikibot.pagegenerators import GeneratorFactory
     mh_wikis = get_wiki_dict()
     s = Site("communities")
     gen = GeneratorFactory(s)
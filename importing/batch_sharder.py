@@ -0,0 +1,101 @@
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from importing.dump_io import dump_stem, is_compressed, COMPRESSED_SUFFIXES
+from importing.import_sharder import shard_with_options, logger
+
+# Rough memory use of one worker: the interpreter plus the largest page, which is held in memory while it is sharded
+WORKER_MEMORY = 300 * 1000 ** 2
+# Memory the ffd planner and the zero-copy sharder need per byte of uncompressed dump for their page measurements
+PLANNED_MEMORY_PER_BYTE = 0.02
+# Assumed ratio of uncompressed to compressed size, for estimating how much xml a compressed dump holds
+COMPRESSION_RATIOS = {".gz": 5, ".bz2": 10, ".7z": 20}
+
+
+def expand_inputs(pattern: str) -> list[Path]:
+    """
+    Dumps in a directory, or the files matching a glob.
+    """
+    path = Path(pattern)
+    if path.is_dir():
+        suffixes = (".xml",) + tuple(f".xml{suffix}" for suffix in COMPRESSED_SUFFIXES)
+        return sorted(file for file in path.iterdir() if file.is_file() and file.name.lower().endswith(suffixes))
+    return sorted(Path(file) for file in glob.glob(pattern, recursive=True) if Path(file).is_file())
+
+
+def unique_names(files: list[Path]) -> dict[Path, str]:
+    """
+    Shard name for every dump. Dumps with the same name in different directories, or the same dump in
+    different compressions, get a short hash of their path appended so their shards do not overwrite each other.
+    """
+    stems: dict[str, list[Path]] = {}
+    for file in files:
+        stems.setdefault(dump_stem(file), []).append(file)
+    names = {}
+    for stem, group in stems.items():
+        for file in group:
+            if len(group) == 1:
+                names[file] = stem
+            else:
+                names[file] = f"{stem}-{hashlib.sha1(str(file.resolve()).encode('utf-8')).hexdigest()[:8]}"
+    return names
+
+
+def estimate_memory(file: Path, args) -> int:
+    if args.gzip or args.planner != "ffd" and not args.zero_copy:
+        # The streaming modes only hold the current page
+        return WORKER_MEMORY
+    size = file.stat().st_size
+    if is_compressed(file):
+        size *= COMPRESSION_RATIOS[file.suffix.lower()]
+    return WORKER_MEMORY + int(size * PLANNED_MEMORY_PER_BYTE)
+
+
+def _shard_one(file: Path, args, name: str) -> list[Path]:
+    return shard_with_options(file, args, name)
+
+
+def shard_batch(files: list[Path], args, workers: int | None, memory_budget: int) -> dict[Path, list[Path]]:
+    """
+    Shard many dumps in a process pool. A dump is only started while the estimated memory of the running
+    dumps and its own fits in memory_budget; a dump that does not fit on its own runs alone.
+    The largest dumps are started first so that the small ones fill the gaps at the end.
+    Returns the shards of every dump that was sharded successfully.
+    """
+    names = unique_names(files)
+    estimates = {file: estimate_memory(file, args) for file in files}
+    pending = sorted(files, key=lambda file: file.stat().st_size, reverse=True)
+    running: dict[Future, Path] = {}
+    results: dict[Path, list[Path]] = {}
+    in_use = 0
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            while pending and len(running) < workers:
+                # The largest dump that fits in the remaining budget
+                fitting = next((file for file in pending if in_use + estimates[file] <= memory_budget), None)
+                if fitting is None:
+                    if running:
+                        break
+                    fitting = pending[0]
+                    logger.warning(f"{fitting.name} needs an estimated {estimates[fitting] / 1e6:.0f}MB, more than "
+                                   f"the memory budget of {memory_budget / 1e6:.0f}MB. Sharding it alone.")
+                pending.remove(fitting)
+                in_use += estimates[fitting]
+                running[executor.submit(_shard_one, fitting, args, names[fitting])] = fitting
+                logger.info(f"Sharding {fitting.name} as {names[fitting]}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                file = running.pop(future)
+                in_use -= estimates[file]
+                try:
+                    results[file] = future.result()
+                except (Exception, SystemExit) as e:
+                    logger.error(f"Failed to shard {file.name}: {e!r}")
+                    continue
+                logger.info(f"Sharded {file.name} into {len(results[file])} files")
+    logger.info(f"Sharded {len(results)} of {len(files)} dumps into {sum(map(len, results.values()))} files.")
+    return results
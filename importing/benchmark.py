@@ -0,0 +1,211 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+
+from importing.dump_generator import DumpSpec, generate_dump, parse_size
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _parse_lines(file: Path, output_dir: Path) -> float:
+    from importing.import_sharder import parse_file
+    start = time.perf_counter()
+    parse_file(file)
+    return time.perf_counter() - start
+
+
+def _partition_by_size(file: Path, output_dir: Path) -> float:
+    # Only the partitioning is timed, but the parsed file counts towards peak memory
+    from importing.import_sharder import parse_file, partition_by_size, str_size, LENGTH_TARGET_LIMIT
+    parsed = parse_file(file)
+    budget = LENGTH_TARGET_LIMIT - str_size(parsed.template_start) - str_size(parsed.template_end)
+    start = time.perf_counter()
+    partition_by_size(parsed.pages, budget)
+    return time.perf_counter() - start
+
+
+def _shard_file(file: Path, output_dir: Path) -> float:
+    from importing.import_sharder import shard_file
+    start = time.perf_counter()
+    shard_file(file, output_dir=output_dir)
+    return time.perf_counter() - start
+
+
+def _shard_file_gzip(file: Path, output_dir: Path) -> float:
+    from importing.import_sharder import shard_file
+    start = time.perf_counter()
+    shard_file(file, compress=True, output_dir=output_dir)
+    return time.perf_counter() - start
+
+
+def _shard_file_planned(file: Path, output_dir: Path) -> float:
+    from importing.shard_planner import shard_file_planned
+    start = time.perf_counter()
+    shard_file_planned(file, output_dir=output_dir)
+    return time.perf_counter() - start
+
+
+def _shard_file_by_offsets(file: Path, output_dir: Path) -> float:
+    from importing.dump_offsets import shard_file_by_offsets
+    start = time.perf_counter()
+    shard_file_by_offsets(file, output_dir=output_dir)
+    return time.perf_counter() - start
+
+
+def _xml_to_db(file: Path, output_dir: Path) -> float:
+    from importing.xml_to_db import load_dump
+    start = time.perf_counter()
+    load_dump(file)
+    return time.perf_counter() - start
+
+
+def _xml_to_db_bulk(file: Path, output_dir: Path) -> float:
+    from importing.xml_to_db import load_dump
+    start = time.perf_counter()
+    load_dump(file, bulk=True)
+    return time.perf_counter() - start
+
+
+STAGES = {
+    "parse_lines": _parse_lines,
+    "partition_by_size": _partition_by_size,
+    "shard_file": _shard_file,
+    "shard_file_gzip": _shard_file_gzip,
+    "shard_file_planned": _shard_file_planned,
+    "shard_file_by_offsets": _shard_file_by_offsets,
+    "xml_to_db": _xml_to_db,
+    "xml_to_db_bulk": _xml_to_db_bulk,
+}
+
+
+# Stages that write shards; their output is validated so broken shards are not reported as throughput
+SHARDING_STAGES = {"shard_file", "shard_file_gzip", "shard_file_planned", "shard_file_by_offsets"}
+
+
+@dataclass
+class StageResult:
+    stage: str
+    input_size: int
+    seconds: float | None
+    peak_rss: int | None
+    error: str | None = None
+
+    @property
+    def throughput(self) -> float | None:
+        return self.input_size / 1e6 / self.seconds if self.seconds else None
+
+    def __str__(self):
+        if self.error is not None:
+            return f"{self.stage:<24}{self.input_size / 1e6:>10.0f}MB  failed: {self.error}"
+        return (f"{self.stage:<24}{self.input_size / 1e6:>10.0f}MB{self.seconds:>10.2f}s"
+                f"{self.throughput:>10.1f}MB/s{self.peak_rss / 1e6:>10.0f}MB peak RSS")
+
+
+def peak_rss() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def run_stage(stage: str, file: Path, result_file: Path) -> None:
+    """
+    Entry point of the child process that runs a single stage, so every stage gets its own peak RSS.
+    """
+    output_dir = Path("shards")
+    output_dir.mkdir(exist_ok=True)
+    seconds = STAGES[stage](file, output_dir)
+    # Measured before validating, which is not part of the stage
+    rss = peak_rss()
+    error = check_shards(output_dir) if stage in SHARDING_STAGES else None
+    result_file.write_text(json.dumps({"seconds": seconds, "peak_rss": rss, "error": error}))
+
+
+def check_shards(output_dir: Path) -> str | None:
+    from importing.import_sharder import list_shards
+    from importing.shard_validator import validate_shard
+    files = list_shards(output_dir)
+    if not files:
+        return "wrote no shards"
+    invalid = [result for result in map(validate_shard, files) if not result.ok]
+    if invalid:
+        return f"{len(invalid)} of {len(files)} shards are invalid, e.g. {invalid[0].name}: {invalid[0].errors[0]}"
+    return None
+
+
+def measure_stage(stage: str, file: Path) -> StageResult:
+    size = file.stat().st_size
+    # Each stage runs in a scratch directory, since the modules create their cache, logs and databases in the cwd
+    with tempfile.TemporaryDirectory(prefix=f"benchmark_{stage}_") as work_dir:
+        result_file = Path(work_dir) / "result.json"
+        env = os.environ | {"PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")]))}
+        process = subprocess.run(
+            [sys.executable, "-m", "importing.benchmark", "run-stage", stage, str(file.resolve()), str(result_file)],
+            cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0 or not result_file.exists():
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}"
+            return StageResult(stage, size, None, None, error)
+        result = json.loads(result_file.read_text())
+    return StageResult(stage, size, result["seconds"], result["peak_rss"], result["error"])
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the import stages on synthetic dumps.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Generate dumps and benchmark every stage on them.")
+    run_parser.add_argument("--sizes", nargs="+", type=parse_size, default=[parse_size("100MB")],
+                            help="Dump sizes, e.g. 100MB 1GB 20GB")
+    run_parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    run_parser.add_argument("--work-dir", type=str, default=tempfile.gettempdir(),
+                            help="Where the dumps are generated. Dumps that already exist are reused.")
+    run_parser.add_argument("--tag-prefix", type=str, default="")
+    run_parser.add_argument("--single-line", action="store_true")
+    run_parser.add_argument("--text-size", type=int, default=2000)
+    run_parser.add_argument("--max-revisions", type=int, default=10)
+    run_parser.add_argument("--keep", action="store_true", help="Keep the dumps generated by this run")
+    run_parser.add_argument("--output", type=str, help="Also append the results to this file")
+
+    stage_parser = subparsers.add_parser("run-stage", help="Run one stage (used internally).")
+    stage_parser.add_argument("stage", choices=list(STAGES))
+    stage_parser.add_argument("file", type=str)
+    stage_parser.add_argument("result_file", type=str)
+    args = parser.parse_args()
+
+    if args.command == "run-stage":
+        run_stage(args.stage, Path(args.file), Path(args.result_file))
+        return
+
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    lines = []
+    for size in args.sizes:
+        layout = ("single" if args.single_line else "pretty") + (f"_{args.tag_prefix[:-1]}" if args.tag_prefix else "")
+        file = work_dir / f"benchmark_{size // 1000 ** 2}MB_{layout}_{args.text_size}_{args.max_revisions}.xml"
+        generated = not file.exists()
+        if generated:
+            spec = DumpSpec(target_size=size, tag_prefix=args.tag_prefix, single_line=args.single_line,
+                            text_size_median=args.text_size, max_revisions=args.max_revisions)
+            start = time.perf_counter()
+            generate_dump(file, spec)
+            print(f"Generated {file.name} in {time.perf_counter() - start:.1f}s", flush=True)
+        for stage in args.stages:
+            result = measure_stage(stage, file)
+            print(result, flush=True)
+            lines.append(str(result))
+        # Dumps that were only reused belong to an earlier run
+        if generated and not args.keep:
+            file.unlink()
+    if args.output is not None:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
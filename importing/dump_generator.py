@@ -0,0 +1,197 @@
+import random
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+# Namespaces that real wikis have most pages in, with the prefix their titles carry
+NAMESPACE_NAMES = {0: "", 1: "Talk:", 2: "User:", 3: "User talk:", 4: "Project:", 6: "File:", 10: "Template:",
+                   14: "Category:", 828: "Module:"}
+
+# Wikitext-like words, already escaped the way they appear inside <text>
+WORDS = ["the", "of", "and", "wiki", "page", "edit", "history", "village", "river", "année", "größe", "東京",
+         "[[Link]]", "[[Category:Places]]", "{{Infobox}}", "'''bold'''", "''italic''", "&lt;ref&gt;", "&lt;/ref&gt;",
+         "&amp;", "&quot;quoted&quot;", "==", "Section", "==", "\n", "\n\n", "*", "|", "}}", "{{cite web", "url=",
+         "https://example.org/", "1999", "2024"]
+
+
+@dataclass
+class DumpSpec:
+    pages: int = 1000
+    min_revisions: int = 1
+    max_revisions: int = 10
+    # Text sizes follow a log-normal distribution with this median, in bytes
+    text_size_median: int = 2000
+    text_size_sigma: float = 1.5
+    namespaces: tuple[int, ...] = (0, 0, 0, 0, 1, 2, 3, 4, 6, 10, 14, 828)
+    # e.g. "ns0:" for dumps written by xml.etree, which prefixes every tag
+    tag_prefix: str = ""
+    single_line: bool = False
+    # Share of revisions made by anonymous (ip) editors
+    anonymous_ratio: float = 0.1
+    # If set, pages are generated until the dump has at least this many bytes and `pages` is ignored
+    target_size: int | None = None
+    seed: int = 1
+
+
+class TextSource:
+    """
+    Slices of a pre-generated corpus, so that gigabytes of text can be produced quickly.
+    """
+
+    def __init__(self, rng: random.Random, corpus_size: int = 4 * 1024 * 1024):
+        words = []
+        size = 0
+        while size < corpus_size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        self.corpus = " ".join(words).encode("utf-8")
+        self.rng = rng
+
+    def text(self, size: int) -> bytes:
+        size = min(size, len(self.corpus) // 2)
+        start = self.rng.randrange(0, len(self.corpus) - size)
+        # Cut at spaces so that no character or entity is split
+        start = self.corpus.find(b" ", start) + 1
+        end = self.corpus.rfind(b" ", start, start + size)
+        if end <= start:
+            return b"a" * size
+        return self.corpus[start:end]
+
+
+class DumpGenerator:
+    def __init__(self, spec: DumpSpec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.texts = TextSource(self.rng)
+        self.revision_id = 0
+        self.newline = "" if spec.single_line else "\n"
+        self.indent = (lambda depth: "") if spec.single_line else (lambda depth: "  " * depth)
+
+    def tag(self, depth: int, name: str, value: str, attributes: str = "") -> str:
+        p = self.spec.tag_prefix
+        return f"{self.indent(depth)}<{p}{name}{attributes}>{value}</{p}{name}>{self.newline}"
+
+    def open_tag(self, depth: int, name: str, attributes: str = "") -> str:
+        return f"{self.indent(depth)}<{self.spec.tag_prefix}{name}{attributes}>{self.newline}"
+
+    def close_tag(self, depth: int, name: str) -> str:
+        return f"{self.indent(depth)}</{self.spec.tag_prefix}{name}>{self.newline}"
+
+    def header(self) -> bytes:
+        spec = self.spec
+        xmlns = "http://www.mediawiki.org/xml/export-0.11/"
+        if spec.tag_prefix:
+            attributes = f' xmlns:{spec.tag_prefix[:-1]}="{xmlns}" version="0.11" xml:lang="en"'
+        else:
+            attributes = f' xmlns="{xmlns}" version="0.11" xml:lang="en"'
+        parts = [self.open_tag(0, "mediawiki", attributes),
+                 self.open_tag(1, "siteinfo"),
+                 self.tag(2, "sitename", "Benchmark Wiki"),
+                 self.tag(2, "dbname", "benchmarkwiki"),
+                 self.tag(2, "base", "https://benchmark.example.org/wiki/Main_Page"),
+                 self.tag(2, "generator", "MediaWiki 1.42.1"),
+                 self.close_tag(1, "siteinfo")]
+        return "".join(parts).encode("utf-8")
+
+    def footer(self) -> bytes:
+        return self.close_tag(0, "mediawiki").encode("utf-8")
+
+    def revision(self, timestamp: int) -> bytes:
+        spec = self.spec
+        self.revision_id += 1
+        size = max(1, int(self.rng.lognormvariate(0, spec.text_size_sigma) * spec.text_size_median))
+        text = self.texts.text(size)
+        if self.rng.random() < spec.anonymous_ratio:
+            contributor = self.tag(4, "ip", f"192.0.2.{self.rng.randrange(1, 255)}")
+        else:
+            user = self.rng.randrange(1, 5000)
+            contributor = self.tag(4, "username", f"User{user}") + self.tag(4, "id", str(user))
+        p = spec.tag_prefix
+        parts = [self.open_tag(2, "revision"),
+                 self.tag(3, "id", str(self.revision_id)),
+                 self.tag(3, "timestamp", f"{2005 + timestamp // 12:04d}-{timestamp % 12 + 1:02d}-01T00:00:00Z"),
+                 self.open_tag(3, "contributor"),
+                 contributor,
+                 self.close_tag(3, "contributor"),
+                 self.tag(3, "comment", "Benchmark edit"),
+                 self.tag(3, "model", "wikitext"),
+                 self.tag(3, "format", "text/x-wiki"),
+                 f'{self.indent(3)}<{p}text bytes="{len(text)}" xml:space="preserve">']
+        return "".join(parts).encode("utf-8") + text + (
+            f"</{p}text>{self.newline}" + self.tag(3, "sha1", "") + self.close_tag(2, "revision")).encode("utf-8")
+
+    def page(self, number: int) -> bytes:
+        spec = self.spec
+        namespace = self.rng.choice(spec.namespaces)
+        title = f"{NAMESPACE_NAMES.get(namespace, '')}Benchmark page {number}"
+        parts = [(self.open_tag(1, "page")
+                  + self.tag(2, "title", title)
+                  + self.tag(2, "ns", str(namespace))
+                  + self.tag(2, "id", str(number + 1))).encode("utf-8")]
+        count = self.rng.randint(spec.min_revisions, spec.max_revisions)
+        # Revisions are in chronological order, each in a different month
+        timestamps = sorted(self.rng.sample(range(12 * 20), min(count, 12 * 20)))
+        for timestamp in timestamps:
+            parts.append(self.revision(timestamp))
+        parts.append(self.close_tag(1, "page").encode("utf-8"))
+        return b"".join(parts)
+
+    def write(self, out: BinaryIO) -> int:
+        size = out.write(self.header())
+        number = 0
+        while True:
+            if self.spec.target_size is not None:
+                if size >= self.spec.target_size:
+                    break
+            elif number >= self.spec.pages:
+                break
+            size += out.write(self.page(number))
+            number += 1
+        size += out.write(self.footer())
+        return size
+
+
+def generate_dump(file: Path, spec: DumpSpec) -> int:
+    with open(file, "wb", buffering=4 * 1024 * 1024) as f:
+        return DumpGenerator(spec).write(f)
+
+
+def parse_size(value: str) -> int:
+    """
+    Sizes like 100MB or 20GB (powers of 1000).
+    """
+    units = {"KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
+    value = value.strip().upper()
+    for unit, factor in units.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def main():
+    parser = ArgumentParser(description="Write a synthetic MediaWiki xml export for benchmarks.")
+    parser.add_argument('-o', '--output', required=True, type=str)
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--pages', type=int, default=1000)
+    size.add_argument('--size', type=parse_size, help='Approximate size of the dump, e.g. 100MB or 20GB')
+    parser.add_argument('--min-revisions', type=int, default=1)
+    parser.add_argument('--max-revisions', type=int, default=10)
+    parser.add_argument('--text-size', type=int, default=2000, help='Median size of a revision text in bytes')
+    parser.add_argument('--text-size-sigma', type=float, default=1.5,
+                        help='Spread of the log-normal text size distribution')
+    parser.add_argument('--tag-prefix', type=str, default="", help='Namespace prefix of every tag, e.g. ns0:')
+    parser.add_argument('--single-line', action='store_true', help='Write the whole dump on a single line')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    spec = DumpSpec(pages=args.pages, min_revisions=args.min_revisions, max_revisions=args.max_revisions,
+                    text_size_median=args.text_size, text_size_sigma=args.text_size_sigma,
+                    tag_prefix=args.tag_prefix, single_line=args.single_line, target_size=args.size,
+                    seed=args.seed)
+    size = generate_dump(Path(args.output), spec)
+    print(f"Wrote {size / 1e6:.1f}MB to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
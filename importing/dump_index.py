@@ -0,0 +1,200 @@
+import html
+import mmap
+import os
+import re
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+from importing.dump_io import is_compressed
+from importing.dump_offsets import ByteRange, DumpLayout, PageSpan, TITLE_PATTERN, NAMESPACE_PATTERN, index_dump
+from importing.import_sharder import logger
+
+INDEX_SUFFIX = ".index.sqlite"
+# Pages whose rows are collected before they are written, so memory stays flat on large dumps
+INSERT_BATCH_SIZE = 10000
+
+ID_PATTERN = re.compile(rb"<(?:ns\d+:)?id>(\d+)</(?:ns\d+:)?id>")
+TIMESTAMP_PATTERN = re.compile(rb"<(?:ns\d+:)?timestamp>(.*?)</(?:ns\d+:)?timestamp>")
+
+
+@dataclass(slots=True)
+class IndexedPage:
+    page_id: int | None
+    title: str
+    namespace: int | None
+    offset: int
+    # Total size of the page in bytes
+    length: int
+    revisions: int
+    first_timestamp: str | None
+    last_timestamp: str | None
+
+
+def index_path(file: Path) -> Path:
+    return file.with_name(file.name + INDEX_SUFFIX)
+
+
+def _search(pattern: re.Pattern, data: mmap.mmap, byte_range: ByteRange) -> bytes | None:
+    match = pattern.search(data, byte_range.start, byte_range.end)
+    return match.group(1) if match is not None else None
+
+
+def _init_index(conn: sqlite3.Connection) -> None:
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE pages (
+        page_number INTEGER PRIMARY KEY,
+        page_id INTEGER,
+        title TEXT NOT NULL,
+        namespace INTEGER,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        revisions INTEGER NOT NULL,
+        first_timestamp TEXT,
+        last_timestamp TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE revisions (
+        page_number INTEGER NOT NULL REFERENCES pages(page_number),
+        revision_id INTEGER,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        timestamp TEXT
+    )
+    """)
+
+
+def build_index(file: Path) -> Path:
+    """
+    Scan an uncompressed dump once and write its sqlite index next to it.
+    """
+    if is_compressed(file):
+        raise ValueError(f"Cannot index {file.name}: byte offsets are only meaningful in an uncompressed file.")
+    path = index_path(file)
+    temp_path = path.with_name(path.name + ".tmp")
+    temp_path.unlink(missing_ok=True)
+    with open(file, "rb") as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        layout = index_dump(data)
+        conn = sqlite3.connect(temp_path)
+        try:
+            _init_index(conn)
+            stat = os.stat(file)
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("source_size", stat.st_size),
+                ("source_mtime_ns", stat.st_mtime_ns),
+                ("template_start_end", layout.template_start.end),
+                ("template_end_start", layout.template_end.start),
+            ])
+            page_rows = []
+            revision_rows = []
+
+            def write_rows():
+                conn.executemany("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", page_rows)
+                conn.executemany("INSERT INTO revisions VALUES (?, ?, ?, ?, ?)", revision_rows)
+                page_rows.clear()
+                revision_rows.clear()
+
+            for number, page in enumerate(layout.pages):
+                header = page.header
+                page_id = _search(ID_PATTERN, data, header)
+                title = _search(TITLE_PATTERN, data, header)
+                namespace = _search(NAMESPACE_PATTERN, data, header)
+                timestamps = []
+                for revision in page.revisions:
+                    revision_id = _search(ID_PATTERN, data, revision)
+                    timestamp = _search(TIMESTAMP_PATTERN, data, revision)
+                    timestamp = timestamp.decode("utf-8") if timestamp is not None else None
+                    if timestamp is not None:
+                        timestamps.append(timestamp)
+                    revision_rows.append((number, int(revision_id) if revision_id is not None else None,
+                                          revision.start, revision.size, timestamp))
+                page_rows.append((
+                    number,
+                    int(page_id) if page_id is not None else None,
+                    html.unescape(title.decode("utf-8")) if title is not None else "",
+                    int(namespace) if namespace is not None else None,
+                    page.start, page.size, len(page.revisions),
+                    min(timestamps, default=None), max(timestamps, default=None)
+                ))
+                if len(page_rows) >= INSERT_BATCH_SIZE:
+                    write_rows()
+            write_rows()
+            conn.execute("CREATE INDEX pages_title ON pages(title)")
+            conn.execute("CREATE INDEX pages_page_id ON pages(page_id)")
+            conn.execute("CREATE INDEX revisions_page_number ON revisions(page_number)")
+            conn.commit()
+        finally:
+            conn.close()
+    os.replace(temp_path, path)
+    logger.info(f"Indexed {len(layout.pages)} pages of {file.name} in {path.name}.")
+    return path
+
+
+def open_index(file: Path) -> sqlite3.Connection | None:
+    """
+    Connection to the index of a dump, or None if there is none or the dump changed since it was built.
+    """
+    path = index_path(file)
+    if not path.exists():
+        return None
+    conn = sqlite3.connect(path)
+    meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    stat = os.stat(file)
+    if meta.get("source_size") != stat.st_size or meta.get("source_mtime_ns") != stat.st_mtime_ns:
+        logger.warning(f"Index {path.name} is out of date with {file.name} and is ignored.")
+        conn.close()
+        return None
+    return conn
+
+
+def load_layout(file: Path) -> DumpLayout | None:
+    """
+    Byte layout of a dump read from its index instead of scanning the dump.
+    """
+    conn = open_index(file)
+    if conn is None:
+        return None
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        pages = [PageSpan(offset, offset + length)
+                 for offset, length in conn.execute("SELECT offset, length FROM pages ORDER BY page_number")]
+        for number, offset, length in conn.execute(
+                "SELECT page_number, offset, length FROM revisions ORDER BY page_number, offset"):
+            pages[number].revisions.append(ByteRange(offset, offset + length))
+    finally:
+        conn.close()
+    return DumpLayout(ByteRange(0, meta["template_start_end"]), pages,
+                      ByteRange(meta["template_end_start"], meta["source_size"]))
+
+
+def find_page(file: Path, title: str | None = None, page_id: int | None = None) -> IndexedPage | None:
+    """
+    Look up a page of an uncompressed dump in its index, building the index first if needed.
+    """
+    conn = open_index(file)
+    if conn is None:
+        build_index(file)
+        conn = open_index(file)
+    columns = "page_id, title, namespace, offset, length, revisions, first_timestamp, last_timestamp"
+    try:
+        if title is not None:
+            row = conn.execute(f"SELECT {columns} FROM pages WHERE title = ?", (title,)).fetchone()
+        else:
+            row = conn.execute(f"SELECT {columns} FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+    finally:
+        conn.close()
+    return IndexedPage(*row) if row is not None else None
+
+
+def read_page(file: Path, page: IndexedPage) -> bytes:
+    with open(file, "rb") as f:
+        f.seek(page.offset)
+        return f.read(page.length)
@@ -0,0 +1,166 @@
+import bz2
+import gzip
+import io
+import os
+import shutil
+import subprocess
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import Any, BinaryIO, TextIO
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".7z")
+
+# Multistream bz2 dumps are decompressed in tasks of roughly this many compressed bytes
+BZ2_TASK_SIZE = 8 * 1024 * 1024
+
+
+def is_compressed(file: Path) -> bool:
+    return file.suffix.lower() in COMPRESSED_SUFFIXES
+
+
+def dump_stem(file: Path) -> str:
+    """
+    Name of a dump without its extensions, e.g. "wiki" for wiki.xml.bz2.
+    """
+    name = file.name
+    if is_compressed(file):
+        name = name[:-len(file.suffix)]
+    return name[:-len(".xml")] if name.lower().endswith(".xml") else Path(name).stem
+
+
+class IteratorStream(io.RawIOBase):
+    """
+    Read-only binary stream over an iterator of byte chunks.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], on_close=None):
+        self.chunks = chunks
+        self.buffer = memoryview(b"")
+        self.on_close = on_close
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self.buffer) == 0:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.buffer = memoryview(chunk)
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed and self.on_close is not None:
+            self.on_close()
+        super().close()
+
+
+def find_multistream_index(file: Path) -> Path | None:
+    """
+    Wikimedia-style multistream dumps ship with an index named like
+    wiki-pages-articles-multistream-index.txt.bz2 next to wiki-pages-articles-multistream.xml.bz2.
+    """
+    name = file.name
+    if not name.endswith(".xml.bz2"):
+        return None
+    index = file.with_name(name[:-len(".xml.bz2")] + "-index.txt.bz2")
+    return index if index.exists() else None
+
+
+def read_stream_offsets(index: Path, file_size: int) -> list[int]:
+    """
+    Start offsets of every bz2 stream in the dump, including the header stream at 0 and
+    the end of the file. Index lines look like "offset:page_id:title".
+    """
+    offsets = {0, file_size}
+    with bz2.open(index, "rt", encoding="utf-8") as f:
+        for line in f:
+            offset = line.split(":", 1)[0]
+            if offset.isdigit():
+                offsets.add(int(offset))
+    return sorted(offsets)
+
+
+def _decompress_range(file: Path, start: int, end: int) -> bytes:
+    with open(file, "rb") as f:
+        f.seek(start)
+        # bz2.decompress handles several concatenated streams
+        return bz2.decompress(f.read(end - start))
+
+
+def ordered_map(function: Callable[..., Any], tasks: Iterable[tuple], workers: int) -> Iterator[Any]:
+    """
+    Results of function(*task) for every task, in task order, computed by a pool of processes.
+    Only a bounded number of tasks is in flight, so memory does not grow with the number of tasks.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future] = deque()
+        task_iter = iter(tasks)
+        for task in task_iter:
+            pending.append(executor.submit(function, *task))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            result = pending.popleft().result()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append(executor.submit(function, *next_task))
+            yield result
+
+
+def _parallel_bz2_chunks(file: Path, offsets: list[int], workers: int) -> Iterator[bytes]:
+    tasks: list[tuple[int, int]] = []
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= BZ2_TASK_SIZE or offset == offsets[-1]:
+            tasks.append((start, offset))
+            start = offset
+    yield from ordered_map(_decompress_range, ((file, start, end) for start, end in tasks), workers)
+
+
+def _open_7z(file: Path) -> BinaryIO:
+    executable = shutil.which("7z") or shutil.which("7za")
+    if executable is None:
+        raise FileNotFoundError("7z is needed to read .7z dumps but was not found on PATH")
+    process = subprocess.Popen([executable, "x", "-so", str(file)], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+
+    def chunks() -> Iterator[bytes]:
+        while chunk := process.stdout.read(1024 * 1024):
+            yield chunk
+
+    def close():
+        process.stdout.close()
+        process.wait()
+
+    return io.BufferedReader(IteratorStream(chunks(), on_close=close), buffer_size=1024 * 1024)
+
+
+def open_dump_binary(file: Path, workers: int | None = None) -> BinaryIO:
+    """
+    Open a dump for streaming reads, decompressing .gz, .bz2 and .7z files on the fly.
+    A multistream .bz2 dump with an index next to it is decompressed on several cores.
+    """
+    suffix = file.suffix.lower()
+    if suffix == ".gz":
+        return gzip.open(file, "rb")
+    if suffix == ".bz2":
+        index = find_multistream_index(file)
+        workers = workers or os.cpu_count() or 1
+        if index is None or workers == 1:
+            return bz2.open(file, "rb")
+        offsets = read_stream_offsets(index, file.stat().st_size)
+        return io.BufferedReader(IteratorStream(_parallel_bz2_chunks(file, offsets, workers)),
+                                 buffer_size=1024 * 1024)
+    if suffix == ".7z":
+        return _open_7z(file)
+    return open(file, "rb")
+
+
+def open_dump(file: Path, workers: int | None = None) -> TextIO:
+    return io.TextIOWrapper(open_dump_binary(file, workers), encoding="utf-8")
@@ -0,0 +1,219 @@
+import html
+import mmap
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+
+from importing.dump_io import dump_stem
+from importing.import_sharder import LENGTH_TARGET_LIMIT, LENGTH_HARD_LIMIT, xml_cache_dir, logger
+from importing.page_filter import PageFilter
+from importing.shard_planner import PageSizes, ShardPlan, plan_shards
+
+# Markup characters are always escaped inside text, so every "<page", "<revision" or "</mediawiki"
+# in the raw bytes is a real tag and the dump can be indexed without decoding it.
+TAG_PATTERN = re.compile(rb"<(/?)(?:ns\d+:)?(page|revision|mediawiki)\b[^>]*>")
+TITLE_PATTERN = re.compile(rb"<(?:ns\d+:)?title>(.*?)</(?:ns\d+:)?title>", re.DOTALL)
+NAMESPACE_PATTERN = re.compile(rb"<(?:ns\d+:)?ns>(-?\d+)</(?:ns\d+:)?ns>")
+
+
+@dataclass(slots=True)
+class ByteRange:
+    start: int
+    end: int
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+@dataclass(slots=True)
+class PageSpan:
+    """
+    Byte offsets of one page. The span runs from the page's start tag to the start of the next page,
+    so concatenating every span of a dump reproduces it byte for byte.
+    """
+    start: int
+    end: int
+    revisions: list[ByteRange] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    @property
+    def header(self) -> ByteRange:
+        return ByteRange(self.start, self.revisions[0].start if self.revisions else self.end)
+
+    @property
+    def footer(self) -> ByteRange:
+        return ByteRange(self.revisions[-1].end if self.revisions else self.end, self.end)
+
+
+@dataclass
+class DumpLayout:
+    template_start: ByteRange
+    pages: list[PageSpan]
+    template_end: ByteRange
+
+
+@dataclass
+class PagePart:
+    """
+    A whole page, or a group of consecutive revisions of a page wrapped in its header and footer.
+    """
+    page: PageSpan
+    revisions: list[ByteRange] | None = None
+
+    @property
+    def size(self) -> int:
+        if self.revisions is None:
+            return self.page.size
+        return self.page.header.size + self.page.footer.size + sum(r.size for r in self.revisions)
+
+    def ranges(self) -> list[ByteRange]:
+        if self.revisions is None:
+            return [ByteRange(self.page.start, self.page.end)]
+        return [self.page.header, *self.revisions, self.page.footer]
+
+
+def index_dump(data: mmap.mmap | bytes) -> DumpLayout:
+    pages: list[PageSpan] = []
+    current: PageSpan | None = None
+    revision_start: int | None = None
+    first_page = None
+    end_tag = None
+    for match in TAG_PATTERN.finditer(data):
+        closing, tag = match.group(1) == b"/", match.group(2)
+        if tag == b"page" and not closing:
+            if current is not None:
+                current.end = match.start()
+            elif first_page is None:
+                first_page = match.start()
+            current = PageSpan(match.start(), match.start())
+            pages.append(current)
+        elif tag == b"revision":
+            if not closing:
+                if current.revisions:
+                    # Whitespace between two revisions belongs to the earlier one
+                    current.revisions[-1].end = match.start()
+                revision_start = match.start()
+            else:
+                current.revisions.append(ByteRange(revision_start, match.end()))
+        elif tag == b"page" and closing:
+            # A page runs until the next page starts; see PageSpan
+            current.end = match.end()
+        elif tag == b"mediawiki" and closing:
+            end_tag = match.start()
+            if current is not None:
+                current.end = end_tag
+    if end_tag is None:
+        logger.error("No </mediawiki> tag found in xml file. Aborting.")
+        exit(1)
+    if first_page is None:
+        first_page = end_tag
+    return DumpLayout(ByteRange(0, first_page), pages, ByteRange(end_tag, len(data)))
+
+
+def page_title(data: mmap.mmap | bytes, page: PageSpan) -> str:
+    header = page.header
+    match = TITLE_PATTERN.search(data, header.start, header.end)
+    return html.unescape(match.group(1).decode("utf-8")) if match is not None else ""
+
+
+def page_namespace(data: mmap.mmap | bytes, page: PageSpan) -> int | None:
+    header = page.header
+    match = NAMESPACE_PATTERN.search(data, header.start, header.end)
+    return int(match.group(1)) if match is not None else None
+
+
+def page_sizes(layout: DumpLayout) -> list[PageSizes]:
+    return [PageSizes(page.header.size + page.footer.size, [r.size for r in page.revisions])
+            for page in layout.pages]
+
+
+def to_page_parts(layout: DumpLayout, plan: ShardPlan) -> list[list[PagePart]]:
+    result = []
+    for shard in plan:
+        parts = []
+        for part in shard:
+            page = layout.pages[part.page]
+            if part.revisions is None:
+                parts.append(PagePart(page))
+            else:
+                parts.append(PagePart(page, page.revisions[part.revisions.start:part.revisions.stop]))
+        result.append(parts)
+    return result
+
+
+def copy_range(source: BinaryIO, data: mmap.mmap, destination: int, byte_range: ByteRange) -> None:
+    """
+    Copy a range of the source file into destination without passing it through Python,
+    using copy_file_range or sendfile when the platform has them.
+    """
+    offset, remaining = byte_range.start, byte_range.size
+    source_fd = source.fileno()
+    while remaining > 0:
+        copied = 0
+        try:
+            if hasattr(os, "copy_file_range"):
+                copied = os.copy_file_range(source_fd, destination, remaining, offset)
+            elif hasattr(os, "sendfile"):
+                copied = os.sendfile(destination, source_fd, offset, remaining)
+        except OSError:
+            # e.g. EXDEV on kernels that cannot copy across file systems
+            copied = 0
+        if copied == 0:
+            copied = os.write(destination, data[offset:offset + min(remaining, 16 * 1024 * 1024)])
+        offset += copied
+        remaining -= copied
+
+
+def write_shards(name: str, source: BinaryIO, data: mmap.mmap, layout: DumpLayout,
+                 shards: list[list[PagePart]], output_dir: Path = xml_cache_dir) -> list[Path]:
+    template_start = data[layout.template_start.start:layout.template_start.end]
+    template_end = data[layout.template_end.start:layout.template_end.end]
+    files = []
+    for file_number, shard in enumerate(shards):
+        file_path = output_dir / f"{name}_{file_number}.xml"
+        destination = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(destination, template_start)
+            for part in shard:
+                for byte_range in part.ranges():
+                    copy_range(source, data, destination, byte_range)
+            os.write(destination, template_end)
+            size = os.lseek(destination, 0, os.SEEK_CUR)
+        finally:
+            os.close(destination)
+        assert size <= LENGTH_HARD_LIMIT, f"File {file_path.name} has size {size}, greater than the configured maximum."
+        logger.info(f"File {file_path.name} is created. It has {len(shard)} pages in it.")
+        files.append(file_path)
+    return files
+
+
+def shard_file_by_offsets(original_file: Path, planner: str = "ffd",
+                          max_size: int = LENGTH_TARGET_LIMIT,
+                          page_filter: PageFilter | None = None,
+                          output_dir: Path = xml_cache_dir, name: str | None = None) -> list[Path]:
+    """
+    Shard an uncompressed dump without decoding it: pages and revisions are located by their byte
+    offsets in a memory map, and shards are assembled by copying byte ranges of the original file.
+    """
+    from importing.dump_index import load_layout
+    with open(original_file, "rb") as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # A dump that has an up-to-date index does not need to be scanned
+        layout = load_layout(original_file) or index_dump(data)
+        logger.info(f"Found {len(layout.pages)} pages in {original_file.name}.")
+        if page_filter is not None:
+            # Only whole pages are filtered; revisions are copied as they are
+            size, count = sum(page.size for page in layout.pages), len(layout.pages)
+            layout.pages = [page for page in layout.pages
+                            if page_filter.keep_page(page_title(data, page), page_namespace(data, page))]
+            kept_size = sum(page.size for page in layout.pages)
+            logger.info(f"Filter keeps {len(layout.pages)} of {count} pages: {kept_size / 1e6:.1f}MB of {size / 1e6:.1f}MB.")
+        budget = max_size - layout.template_start.size - layout.template_end.size
+        shards = to_page_parts(layout, plan_shards(page_sizes(layout), budget, planner))
+        logger.info(f"File partitioned into {len(shards)} groups. Writing them to disk...")
+        return write_shards(name or dump_stem(original_file), source, data, layout, shards, output_dir)
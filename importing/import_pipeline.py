@@ -0,0 +1,114 @@
+import shutil
+import time
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import BinaryIO
+
+import requests
+
+from importing.dump_io import open_dump, dump_stem
+from importing.import_sharder import DumpReader, ShardWriter, GzipShardWriter, upload_xml, xml_cache_dir, logger
+from importing.page_filter import PageFilter, filter_pages, report_filter
+from importing.shard_importer import CsrfToken, BACKOFF_SECONDS, MAX_TOKEN_REFRESHES
+from importing.shard_validator import validate_stream, quarantine_stream
+from utils.general_utils import SessionInfo
+
+
+def upload_shard(name: str, source: BinaryIO, prefix: str, summary: str, session_info: SessionInfo,
+                 token: CsrfToken, max_attempts: int) -> bool:
+    delay = 0
+    attempt = 0
+    refreshes = 0
+    while attempt < max_attempts:
+        time.sleep(delay)
+        source.seek(0)
+        value = token.get()
+        try:
+            outcome = upload_xml(name, source, prefix, summary, session_info, value)
+        except requests.RequestException as e:
+            logger.error(f"Failed to import {name}: {e}")
+            delay = BACKOFF_SECONDS * 2 ** attempt
+            attempt += 1
+            continue
+        if outcome.code == "badtoken" and refreshes < MAX_TOKEN_REFRESHES:
+            # Refreshed and retried without counting the attempt, as import_shard does
+            token.refresh(value)
+            refreshes += 1
+            delay = 0
+            continue
+        if outcome:
+            return True
+        delay = BACKOFF_SECONDS * 2 ** attempt
+        attempt += 1
+    return False
+
+
+def import_dump(original_file: Path, prefix: str, summary: str, session_info: SessionInfo,
+                compress: bool = False, page_filter: PageFilter | None = None, max_attempts: int = 3) -> bool:
+    """
+    Shard a dump and upload every shard as soon as it is complete, without saving it to the cache.
+    The next shard is built while the current one is uploading. At most three shards exist at a time
+    (building, waiting and uploading), each in a spooled temporary file.
+    Every shard is validated before it is queued; invalid shards are quarantined instead of uploaded.
+    Shards that still fail after max_attempts are saved to the cache so the import subcommand can retry them.
+    """
+    shards: Queue[tuple[str, BinaryIO] | None] = Queue(maxsize=1)
+    completed = False
+    invalid = []
+
+    def check_and_queue(name: str, handle: BinaryIO) -> None:
+        size = handle.seek(0, 2)
+        handle.seek(0)
+        result = validate_stream(name, handle, size)
+        handle.seek(0)
+        if result.ok:
+            shards.put((name, handle))
+            return
+        with handle:
+            destination = quarantine_stream(name, handle, result)
+        logger.error(f"{name} is invalid and was saved to {destination}: {'; '.join(result.errors[:3])}")
+        invalid.append(name)
+
+    def produce():
+        nonlocal completed
+        try:
+            with open_dump(original_file) as f:
+                reader = DumpReader(f)
+                writer_class = GzipShardWriter if compress else ShardWriter
+                writer = writer_class(dump_stem(original_file), reader.template_start,
+                                      reader.shard_template_end, sink=check_and_queue)
+                for page in filter_pages(reader.pages(), page_filter):
+                    writer.add(page)
+                writer.close()
+            completed = True
+        finally:
+            shards.put(None)
+
+    if page_filter is not None:
+        # Shards are uploaded while the dump is read, so the filter is dry-run first to report its effect
+        report_filter(original_file, page_filter)
+    producer = Thread(target=produce, name="sharder", daemon=True)
+    producer.start()
+    token = CsrfToken(session_info)
+    imported, failed = 0, []
+    while (item := shards.get()) is not None:
+        name, handle = item
+        with handle:
+            logger.info(f"Uploading {name}")
+            if upload_shard(name, handle, prefix, summary, session_info, token, max_attempts):
+                imported += 1
+                continue
+            logger.error(f"Failed to import {name}. Saving it to the cache.")
+            handle.seek(0)
+            with open(xml_cache_dir / name, "wb") as f:
+                shutil.copyfileobj(handle, f)
+            failed.append(name)
+    producer.join()
+    if not completed:
+        logger.error(f"Sharding {original_file.name} stopped before the end of the dump.")
+    logger.info(f"Imported {imported} shards of {original_file.name}; {len(failed)} failed and were saved to "
+                f"the cache: {', '.join(failed)}")
+    if invalid:
+        logger.error(f"{len(invalid)} shards were invalid and not uploaded: {', '.join(invalid)}")
+    return completed and len(failed) == 0 and len(invalid) == 0
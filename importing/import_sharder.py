@@ -1,13 +1,25 @@
+import html
 import re
 import shutil
+import sys
+import tempfile
+import zlib
 from argparse import ArgumentParser
 from dataclasses import dataclass
-from enum import Enum
+from datetime import datetime, timezone
 from json import JSONDecodeError
 from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, TYPE_CHECKING
 
+import requests
+
+from importing.dump_io import open_dump, dump_stem, is_compressed
+from importing.multipart import MultipartBody
 from utils.general_utils import cache_dir, get_logger, SessionInfo, get_csrf_token, login, headers
 
+if TYPE_CHECKING:
+    from importing.page_filter import PageFilter
+
 # Use 200MB for Special:RequestImport. Use 2MB for Special:Import.
 # Files absolutely cannot be larger than this.
 # Leave a bit of room for header
@@ -20,6 +32,23 @@ xml_cache_dir.mkdir(parents=True, exist_ok=True)
 
 logger = get_logger("import_sharder")
 
+REVISION_START_PATTERN = re.compile("<.*revision.*>")
+REVISION_END_PATTERN = re.compile(r"</(ns\d+:)?revision.*>")
+PAGE_END_PATTERN = re.compile(r"</(ns\d+:)?page.*>")
+SITEINFO_END_PATTERN = re.compile(r"</(ns\d+:)?siteinfo>")
+MEDIAWIKI_START_PATTERN = re.compile(r"<(ns\d+:)?mediawiki[\s>]")
+MEDIAWIKI_END_PATTERN = re.compile(r"</(ns\d+:)?mediawiki>")
+TITLE_PATTERN = re.compile(r"<(?:ns\d+:)?title>(.*?)</(?:ns\d+:)?title>", re.DOTALL)
+NAMESPACE_PATTERN = re.compile(r"<(?:ns\d+:)?ns>(-?\d+)</(?:ns\d+:)?ns>")
+TIMESTAMP_PATTERN = re.compile(r"<(?:ns\d+:)?timestamp>(.*?)</(?:ns\d+:)?timestamp>")
+ID_PATTERN = re.compile(r"<(?:ns\d+:)?id>(\d+)</(?:ns\d+:)?id>")
+# Shards are written before the end of the dump has been read, so they are closed with
+# an end tag made from the dump's root start tag (see closing_template) instead of the one found in the dump.
+DEFAULT_TEMPLATE_END = "</mediawiki>\n"
+# Shards that are streamed to the wiki instead of being saved stay in memory up to this size
+# and spill over to a temporary file after that
+SPOOL_MEMORY_LIMIT = 64 * 1024 * 1024
+
 
 def str_size(string: str | list[str]) -> int:
     if isinstance(string, list):
@@ -39,6 +68,23 @@ class Revision:
     def size(self):
         return str_size(self.lines)
 
+    @property
+    def timestamp(self) -> str | None:
+        for line in self.lines:
+            match = TIMESTAMP_PATTERN.search(line)
+            if match is not None:
+                return match.group(1)
+        return None
+
+    @property
+    def id(self) -> int | None:
+        # The revision's own id comes before the one of its contributor
+        for line in self.lines:
+            match = ID_PATTERN.search(line)
+            if match is not None:
+                return int(match.group(1))
+        return None
+
 
 @dataclass
 class ParsedPage:
@@ -50,6 +96,21 @@ class ParsedPage:
     def size(self):
         return str_size(self.start_tag) + str_size(self.end_tag) + sum(r.size for r in self.revisions)
 
+    @property
+    def title(self) -> str:
+        match = TITLE_PATTERN.search(self.start_tag)
+        return html.unescape(match.group(1)) if match is not None else ""
+
+    @property
+    def namespace(self) -> int | None:
+        match = NAMESPACE_PATTERN.search(self.start_tag)
+        return int(match.group(1)) if match is not None else None
+
+    @property
+    def latest_timestamp(self) -> str | None:
+        # Timestamps are ISO 8601 in UTC, so they compare correctly as strings
+        return max((t for r in self.revisions if (t := r.timestamp) is not None), default=None)
+
     def __str__(self):
         return "".join([self.start_tag,
                           ''.join(str(r) for r in self.revisions),
@@ -73,7 +134,7 @@ def parse_page(lines: list[str]) -> ParsedPage:
     current_revision = []
     revision_start = 0
     while revision_start < len(lines):
-        if re.search("<.*revision.*>", lines[revision_start]):
+        if REVISION_START_PATTERN.search(lines[revision_start]):
             break
         revision_start += 1
     else:
@@ -81,43 +142,63 @@ def parse_page(lines: list[str]) -> ParsedPage:
         exit(1)
     for line in lines[revision_start:-1]:
         current_revision.append(line)
-        if re.search(r"</(ns\d+:)?revision.*>", line) is not None:
+        if REVISION_END_PATTERN.search(line) is not None:
             revisions.append(Revision(current_revision))
             current_revision = []
     return ParsedPage("".join(lines[:revision_start]), revisions, lines[-1])
 
 
-def parse_lines(lines: list[str]) -> ParsedFile:
-    class ParserState(Enum):
-        START = 1
-        PAGES = 2
-
-    state = ParserState.START
-    template_start = []
-    cur_page = []
-    pages: list[ParsedPage] = []
-    template_end = None
-
-    for line in lines:
-        if state == ParserState.START:
+def closing_template(template_start: str) -> str:
+    """
+    End tag of the root element opened in template_start, e.g. </ns0:mediawiki> for a dump with prefixed tags.
+    """
+    match = MEDIAWIKI_START_PATTERN.search(template_start)
+    if match is None or match.group(1) is None:
+        return DEFAULT_TEMPLATE_END
+    return f"</{match.group(1)}mediawiki>\n"
+
+
+class DumpReader:
+    """
+    Reads a dump one page at a time. The header (everything up to </siteinfo>) is read
+    when the reader is created; template_end is only known once pages() is exhausted.
+    Shards written while reading are closed with shard_template_end instead.
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self.lines = iter(lines)
+        self.template_start = self._read_template_start()
+        self.shard_template_end = closing_template(self.template_start)
+        self.template_end: str | None = None
+
+    def _read_template_start(self) -> str:
+        template_start = []
+        for line in self.lines:
             template_start.append(line)
-            if "</siteinfo>" in line:
-                state = ParserState.PAGES
-        elif state == ParserState.PAGES:
-            if "</mediawiki>" in line:
-                template_end = line
+            if SITEINFO_END_PATTERN.search(line) is not None:
+                return "".join(template_start)
+        logger.error(f"No </siteinfo> tag found in xml file. Aborting.")
+        exit(1)
+
+    def pages(self) -> Iterator[ParsedPage]:
+        cur_page = []
+        for line in self.lines:
+            if MEDIAWIKI_END_PATTERN.search(line) is not None:
+                self.template_end = line
                 continue
             cur_page.append(line)
-            if re.search(r"</(ns\d+:)?page.*>", line) is not None:
-                pages.append(parse_page(cur_page))
+            if PAGE_END_PATTERN.search(line) is not None:
+                yield parse_page(cur_page)
                 cur_page = []
-    if state == ParserState.START:
-        logger.error(f"No </siteinfo> tag found in xml file. Aborting.")
-        exit(1)
-    if template_end is None:
-        logger.error("No </mediawiki> tag found in xml file. Aborting.")
-        exit(1)
-    return ParsedFile("".join(template_start), pages, template_end)
+        if self.template_end is None:
+            logger.error("No </mediawiki> tag found in xml file. Aborting.")
+            exit(1)
+
+
+def parse_lines(lines: Iterable[str]) -> ParsedFile:
+    reader = DumpReader(lines)
+    pages = list(reader.pages())
+    return ParsedFile(reader.template_start, pages, reader.template_end)
 
 
 T = ParsedPage | Revision
@@ -150,65 +231,376 @@ def partition_by_size(original: list[T], max_size: int) -> list[list[T]]:
 
 
 def parse_file(file: Path) -> ParsedFile:
-    with open(file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+    with open_dump(file) as f:
+        parsed_file = parse_lines(f)
     logger.info(f"File {file.name} loaded.")
-    return parse_lines(lines)
-
-
-def shard_file(original_file: Path) -> list[Path]:
-    parsed_file = parse_file(original_file)
-    logger.info(f"File {original_file.name} parsed.")
-
-    files = []
-    pages = parsed_file.pages
-
-    remaining_size = LENGTH_TARGET_LIMIT - str_size(parsed_file.template_start) - str_size(parsed_file.template_end)
-    page_groups = partition_by_size(pages, remaining_size)
+    return parsed_file
+
+
+class ShardWriter:
+    """
+    Writes pages to shards as they arrive and closes a shard as soon as the next page would
+    not fit. Only the page being written is held in memory. A page that is larger than a
+    shard on its own is split into groups of revisions, each written to its own shard.
+    """
+
+    def __init__(self, name: str, template_start: str,
+                 template_end: str = DEFAULT_TEMPLATE_END,
+                 max_size: int = LENGTH_TARGET_LIMIT,
+                 output_dir: Path = xml_cache_dir,
+                 sink: Callable[[str, BinaryIO], None] | None = None):
+        self.name = name
+        # With a sink, shards are built in spooled temporary files and handed to it instead of being saved
+        self.sink = sink
+        self.template_start = template_start.encode("utf-8")
+        self.template_end = template_end.encode("utf-8")
+        self.output_dir = output_dir
+        self.page_budget = max_size - len(self.template_start) - len(self.template_end)
+        assert self.page_budget > 0
+        self.files: list[Path] = []
+        self.current_file = None
+        self.current_size = 0
+        self.current_pages = 0
+
+    def _create_file(self, file_path: Path) -> BinaryIO:
+        if self.sink is None:
+            return open(file_path, "wb")
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT)
+
+    def _finish_file(self) -> int:
+        size = self.current_file.tell()
+        if self.sink is None:
+            self.current_file.close()
+        else:
+            self.current_file.seek(0)
+            self.sink(self.files[-1].name, self.current_file)
+        self.current_file = None
+        return size
+
+    def _open_shard(self) -> None:
+        file_path = self.output_dir / f"{self.name}_{len(self.files)}.xml"
+        self.current_file = self._create_file(file_path)
+        self.current_file.write(self.template_start)
+        self.current_size = 0
+        self.current_pages = 0
+        self.files.append(file_path)
+
+    def _close_shard(self) -> None:
+        if self.current_file is None:
+            return
+        self.current_file.write(self.template_end)
+        size = self._finish_file()
+        assert size <= LENGTH_HARD_LIMIT, f"File {self.files[-1].name} has size {size}, greater than the configured maximum."
+        logger.info(f"File {self.files[-1].name} is created. It has {self.current_pages} pages in it.")
+
+    def _write(self, data: bytes) -> None:
+        if self.current_file is None:
+            self._open_shard()
+        self.current_file.write(data)
+        self.current_size += len(data)
+        self.current_pages += 1
+
+    def add(self, page: ParsedPage) -> None:
+        data = str(page).encode("utf-8")
+        if len(data) > self.page_budget:
+            self._close_shard()
+            tag_size = str_size(page.start_tag) + str_size(page.end_tag)
+            for revision_group in partition_by_size(page.revisions, self.page_budget - tag_size):
+                self._write(str(ParsedPage(page.start_tag, revision_group, page.end_tag)).encode("utf-8"))
+                self._close_shard()
+            return
+        if self.current_file is not None and self.current_size + len(data) > self.page_budget:
+            self._close_shard()
+        self._write(data)
+
+    def close(self) -> list[Path]:
+        self._close_shard()
+        return self.files
+
+
+class GzipShardWriter(ShardWriter):
+    """
+    Writes gzip-compressed shards and applies the size limit to the compressed bytes.
+    The stream is flushed after every page so the size of a shard is known exactly while it
+    is being filled. A page is only compressed twice when it may not fit in the current shard.
+    """
+
+    def __init__(self, name: str, template_start: str,
+                 template_end: str = DEFAULT_TEMPLATE_END,
+                 max_size: int = LENGTH_TARGET_LIMIT,
+                 output_dir: Path = xml_cache_dir,
+                 sink: Callable[[str, BinaryIO], None] | None = None,
+                 level: int = 6):
+        super().__init__(name, template_start, template_end, max_size, output_dir, sink)
+        self.max_size = max_size
+        self.level = level
+        self.compressor = None
+        # The end tags, the final flush and the gzip trailer must still fit in a full shard
+        self.tail_size = len(self.template_end) + 64
+
+    @staticmethod
+    def compress_bound(size: int) -> int:
+        # Deflate never grows its input by more than this (see deflateBound in zlib)
+        return size + (size >> 12) + (size >> 14) + 64
+
+    def _open_shard(self) -> None:
+        file_path = self.output_dir / f"{self.name}_{len(self.files)}.xml.gz"
+        self.current_file = self._create_file(file_path)
+        self.compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.current_size = 0
+        self.current_pages = 0
+        self.files.append(file_path)
+        self._write_compressed(self.compressor, self.template_start)
+
+    def _write_compressed(self, compressor, data: bytes) -> None:
+        out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.current_file.write(out)
+        self.current_size += len(out)
+
+    def _try_write(self, data: bytes, reserve: int = 0) -> bool:
+        """
+        Append data to the current shard if it fits, keeping reserve bytes free for what has to follow.
+        """
+        remaining = self.max_size - self.current_size - self.tail_size - reserve
+        if self.compress_bound(len(data)) <= remaining:
+            self._write_compressed(self.compressor, data)
+            return True
+        trial = self.compressor.copy()
+        out = trial.compress(data) + trial.flush(zlib.Z_SYNC_FLUSH)
+        if len(out) > remaining:
+            return False
+        self.compressor = trial
+        self.current_file.write(out)
+        self.current_size += len(out)
+        return True
+
+    def _close_shard(self) -> None:
+        if self.current_file is None:
+            return
+        self.current_file.write(self.compressor.compress(self.template_end) + self.compressor.flush())
+        size = self._finish_file()
+        self.compressor = None
+        assert size <= LENGTH_HARD_LIMIT, f"File {self.files[-1].name} has size {size}, greater than the configured maximum."
+        logger.info(f"File {self.files[-1].name} is created. It has {self.current_pages} pages in it.")
+
+    def add(self, page: ParsedPage) -> None:
+        data = str(page).encode("utf-8")
+        if self.current_file is not None and self._try_write(data):
+            self.current_pages += 1
+            return
+        self._close_shard()
+        self._open_shard()
+        if self._try_write(data):
+            self.current_pages += 1
+            return
+        # Even a shard of its own is too small for this page: split it into groups of revisions
+        start_tag = page.start_tag.encode("utf-8")
+        end_tag = page.end_tag.encode("utf-8")
+        reserve = self.compress_bound(len(end_tag))
+        self._write_compressed(self.compressor, start_tag)
+        in_shard = 0
+        for revision in page.revisions:
+            data = str(revision).encode("utf-8")
+            if self._try_write(data, reserve):
+                in_shard += 1
+                continue
+            if in_shard == 0:
+                logger.error("A revision has compressed size greater than the max allowed size. Aborting.")
+                exit(1)
+            self._write_compressed(self.compressor, end_tag)
+            self.current_pages += 1
+            self._close_shard()
+            self._open_shard()
+            self._write_compressed(self.compressor, start_tag)
+            in_shard = 0
+            if not self._try_write(data, reserve):
+                logger.error("A revision has compressed size greater than the max allowed size. Aborting.")
+                exit(1)
+            in_shard += 1
+        self._write_compressed(self.compressor, end_tag)
+        self.current_pages += 1
+        self._close_shard()
+
+
+def shard_file(original_file: Path, compress: bool = False, page_filter: 'PageFilter | None' = None,
+               output_dir: Path = xml_cache_dir, name: str | None = None) -> list[Path]:
+    from importing.page_filter import filter_pages, report_filter
+    if page_filter is not None:
+        # Shards are written while the dump is read, so the filter is dry-run first to report its effect
+        report_filter(original_file, page_filter)
+    with open_dump(original_file) as f:
+        reader = DumpReader(f)
+        writer_class = GzipShardWriter if compress else ShardWriter
+        writer = writer_class(name or dump_stem(original_file), reader.template_start, reader.shard_template_end,
+                              output_dir=output_dir)
+        for page in filter_pages(reader.pages(), page_filter):
+            writer.add(page)
+        files = writer.close()
+    logger.info(f"File {original_file.name} is split into {len(files)} shards.")
+    return files
 
-    logger.info(f"File partitioned into {len(page_groups)} groups. Writing them to disk...")
 
-    for file_number, page_group in enumerate(page_groups):
-        xml_str = parsed_file.template_start + "".join(str(p) for p in page_group) + parsed_file.template_end
-        assert str_size(xml_str) <= LENGTH_HARD_LIMIT, f"File {file_number} has size {str_size(xml_str)}, greater than the configured maximum."
-        file_path = xml_cache_dir / f"{original_file.stem}_{file_number}.xml"
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(xml_str)
-        logger.info(f"File {file_path.name} is created. It has {len(page_group)} pages in it.")
-        files.append(file_path)
+def shard_sort_key(file: Path) -> tuple[str, int]:
+    stem = dump_stem(file)
+    name, _, number = stem.rpartition("_")
+    return (name, int(number)) if number.isdigit() else (stem, -1)
 
-    return files
 
+def list_shards(directory: Path = xml_cache_dir) -> list[Path]:
+    return sorted([*directory.glob("*.xml"), *directory.glob("*.xml.gz")], key=shard_sort_key)
 
-def import_xml(file: Path, prefix: str, summary: str, session_info: SessionInfo) -> bool:
 
-    with open(file, "rb") as f:
-        files = {
-            "xml": ("dump.xml", f, "application/xml")
-        }
-        data = {
-            "action": "import",
-            "format": "json",
-            "token": get_csrf_token(session_info.session, session_info.url),
-            "interwikiprefix": prefix,  # optional
-            "summary": summary,  # optional
-        }
-        response = session_info.session.post(session_info.url, data=data, files=files, headers=headers)
+@dataclass
+class ImportOutcome:
+    success: bool
+    pages: int = 0
+    revisions: int = 0
+    error: str | None = None
+    # Error code returned by the api, e.g. "badtoken"
+    code: str | None = None
+
+    def __bool__(self) -> bool:
+        return self.success
+
+
+def upload_xml(name: str, source: BinaryIO, prefix: str, summary: str, session_info: SessionInfo,
+               token: str | None = None) -> ImportOutcome:
+    """
+    Upload one shard, streaming it from source. A csrf token is fetched for the upload unless one is passed in.
+    """
+    if token is None:
+        token = get_csrf_token(session_info.session, session_info.url)
+    data = {
+        "action": "import",
+        "format": "json",
+        "token": token,
+        "interwikiprefix": prefix,  # optional
+        "summary": summary,  # optional
+    }
+    if name.endswith(".gz"):
+        body = MultipartBody(data, "xml", "dump.xml.gz", "application/gzip", source)
+    else:
+        body = MultipartBody(data, "xml", "dump.xml", "application/xml", source)
+    response = session_info.session.post(session_info.url, data=body,
+                                         headers=headers | {"Content-Type": body.content_type})
 
     if response.status_code != 200:
-        logger.error(f"Failed to import {file.name}: {response}")
-        return False
+        logger.error(f"Failed to import {name}: {response}")
+        return ImportOutcome(False, error=f"http status {response.status_code}")
     try:
         response = response.json()
     except JSONDecodeError:
-        logger.error(f"Failed to decode json for {file.name}: {response.text}")
-        return False
+        logger.error(f"Failed to decode json for {name}: {response.text}")
+        return ImportOutcome(False, error="invalid json response")
     if 'error' in response or 'import' not in response:
-        logger.error(f"Failed to import {file.name}: {response}")
-        return False
+        logger.error(f"Failed to import {name}: {response}")
+        error = response.get('error', {})
+        return ImportOutcome(False, error=error.get('info', str(response)), code=error.get('code'))
     entries = response['import']
-    logger.info(f"Imported {len(entries)} pages and {sum(entry['revisions'] for entry in entries)} revisions.")
-    return True
+    outcome = ImportOutcome(True, len(entries), sum(entry['revisions'] for entry in entries))
+    logger.info(f"Imported {outcome.pages} pages and {outcome.revisions} revisions from {name}.")
+    return outcome
+
+
+def import_xml(file: Path, prefix: str, summary: str, session_info: SessionInfo,
+               token: str | None = None) -> ImportOutcome:
+    with open(file, "rb") as f:
+        return upload_xml(file.name, f, prefix, summary, session_info, token)
+
+
+def iso_timestamp(value: str) -> str:
+    """
+    Normalize a date or timestamp to the form used in dumps, e.g. 2024-01-01T00:00:00Z.
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def add_filter_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument('--target-url', type=str,
+                        help='Api entry point of the wiki the dump will be imported into. Pages that it '
+                             'already has up to their latest revision are left out of the shards.')
+    parser.add_argument('--target-username', type=str, help='Only needed if the target wiki is private')
+    parser.add_argument('--target-password', type=str)
+    parser.add_argument('--incremental', action='store_true',
+                        help='With --target-url, keep only the revisions that are newer than the latest revision '
+                             'of the same page on the target wiki, e.g. for a catch-up import before cutover.')
+    parser.add_argument('--namespace', type=int, action='append',
+                        help='Only keep pages in this namespace. Can be given more than once.')
+    parser.add_argument('--title-regex', type=str,
+                        help='Only keep pages whose title (with namespace prefix) matches this regular expression')
+    parser.add_argument('--since', type=iso_timestamp,
+                        help='Only keep revisions made at or after this date, e.g. 2024-01-01 or 2024-01-01T12:00:00Z')
+    parser.add_argument('--last-revisions', type=int,
+                        help='Only keep this many of the newest revisions of every page')
+
+
+def page_filter_from_args(args, file: Path) -> 'PageFilter | None':
+    from importing.page_filter import PageFilter
+    page_filter = PageFilter(
+        namespaces=set(args.namespace) if args.namespace is not None else None,
+        title_pattern=re.compile(args.title_regex) if args.title_regex is not None else None,
+        since=args.since,
+        last_revisions=args.last_revisions,
+    )
+    if args.incremental and args.target_url is None:
+        logger.error("--incremental needs --target-url. Aborting.")
+        exit(1)
+    if args.target_url is not None:
+        from importing.target_wiki import find_present_pages, find_target_timestamps
+        if args.target_username is not None:
+            session = login(args.target_url, args.target_username, args.target_password).session
+        else:
+            session = requests.Session()
+        if args.incremental:
+            page_filter.newer_than = find_target_timestamps(file, session, args.target_url)
+        else:
+            page_filter.skip_titles = find_present_pages(file, session, args.target_url)
+    return None if page_filter.is_empty else page_filter
+
+
+def shard_with_options(file: Path, args, name: str | None = None) -> list[Path]:
+    """
+    Shard one dump with the mode and filters chosen on the command line.
+    Shards are named after name, which defaults to the name of the dump.
+    """
+    if args.zero_copy and is_compressed(file):
+        logger.error("--zero-copy needs an uncompressed dump. Aborting.")
+        exit(1)
+    if args.zero_copy and args.gzip:
+        logger.error("--zero-copy copies uncompressed bytes and cannot be combined with --gzip. Aborting.")
+        exit(1)
+    if args.zero_copy and (args.since is not None or args.last_revisions is not None or args.incremental):
+        logger.error("--zero-copy copies whole pages and cannot be combined with --since, --last-revisions "
+                     "or --incremental. Aborting.")
+        exit(1)
+    page_filter = page_filter_from_args(args, file)
+    if args.gzip:
+        return shard_file(file, compress=True, page_filter=page_filter, name=name)
+    if args.zero_copy:
+        from importing.dump_offsets import shard_file_by_offsets
+        return shard_file_by_offsets(file, planner=args.planner, page_filter=page_filter, name=name)
+    if args.planner == 'ffd':
+        from importing.shard_planner import shard_file_planned
+        return shard_file_planned(file, planner=args.planner, page_filter=page_filter, name=name)
+    return shard_file(file, page_filter=page_filter, name=name)
+
+
+def add_shard_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument('--zero-copy', action='store_true',
+                        help='Locate pages by byte offset in a memory map and copy byte ranges into the '
+                             'shards instead of decoding the dump. Needs an uncompressed file.')
+    parser.add_argument('--planner', choices=['greedy', 'ffd'], default='greedy',
+                        help='greedy (default): fill shards in document order in a single pass. '
+                             'ffd: measure the dump first and pack pages into as few shards as possible '
+                             '(first-fit decreasing). This reads the dump twice, so a compressed dump is '
+                             'decompressed twice; with --zero-copy the measuring pass is free.')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Write gzip-compressed shards and apply the size limit to the compressed size. '
+                             'Shards are filled in document order, so --planner has no effect.')
+    add_filter_arguments(parser)
 
 
 def main():
@@ -222,11 +614,25 @@ def main():
     # create the parser for the "a" command
     shard_parser = subparsers.add_parser('shard',
                                          help='Shard a single xml file into multiple xml files and store them in the cache.')
-    shard_parser.add_argument('-f', '--file', required=True, type=str)
+    shard_parser.add_argument('-f', '--file', required=True, type=str,
+                              help='Xml dump, optionally compressed (.gz, .bz2 or .7z)')
+    add_shard_arguments(shard_parser)
+
+    batch_parser = subparsers.add_parser('batch',
+                                         help='Shard many xml files at once in a process pool and store the shards '
+                                              'in the cache.')
+    batch_parser.add_argument('-i', '--input', required=True, type=str,
+                              help='Directory of dumps, or a glob such as "dumps/*-pages-meta-history.xml.bz2"')
+    batch_parser.add_argument('--workers', type=int, help='Number of processes (default: number of cores)')
+    batch_parser.add_argument('--memory-budget', type=str, default="4GB",
+                              help='Estimated memory all workers together may use, e.g. 4GB. A dump that needs '
+                                   'more than the budget on its own is sharded alone.')
+    add_shard_arguments(batch_parser)
 
     import_parser = subparsers.add_parser('import',
                                           help='Import xml files in the cache, which are assumed to be sharded. '
-                                               'Files that are successfully imported will be deleted from the cache.')
+                                               'Imported files are moved to the imported folder of the cache and '
+                                               'recorded in a manifest, so a rerun only retries the rest.')
     import_parser.add_argument('--url', required=True, type=str,
                                help='Api entry point of the wiki (found on [[Special:Version]])')
     import_parser.add_argument('--username', required=True, type=str)
@@ -234,29 +640,137 @@ def main():
     import_parser.add_argument('--prefix', required=True, type=str, help="Interwiki prefix")
     import_parser.add_argument('--summary', default="Import xml dump", type=str,
                                help="Summary of this import")
+    import_parser.add_argument('--parallel', default=2, type=int,
+                               help="Number of shards uploaded at the same time")
+    import_parser.add_argument('--max-attempts', default=3, type=int,
+                               help="Attempts per shard in this run before it is marked as failed")
+    import_parser.add_argument('--skip-validation', action='store_true',
+                               help="Upload shards without validating them first")
+
+    validate_parser = subparsers.add_parser('validate',
+                                            help='Check that the xml files in the cache are well-formed exports '
+                                                 'within the size limit, and move bad ones to the quarantine '
+                                                 'folder of the cache.')
+    validate_parser.add_argument('--workers', type=int, help="Number of processes (default: number of cores)")
+
+    verify_parser = subparsers.add_parser('verify',
+                                          help='Check that the pages and revisions of the imported shards exist on '
+                                               'the wiki. Writes a report to the cache and shards with whatever '
+                                               'is missing, ready for the import subcommand.')
+    verify_parser.add_argument('--url', required=True, type=str,
+                               help='Api entry point of the wiki (found on [[Special:Version]])')
+    verify_parser.add_argument('--username', type=str, help='Only needed if the wiki is private')
+    verify_parser.add_argument('--password', type=str)
+    verify_parser.add_argument('--parallel', default=4, type=int,
+                               help="Number of api requests in flight at the same time")
+    verify_parser.add_argument('--revision-ids', action='store_true',
+                               help="Also look up every revision by its id. Only use this if the wiki kept the "
+                                    "revision ids of the dump.")
+
+    pipeline_parser = subparsers.add_parser('pipeline',
+                                            help='Shard a single xml file and upload every shard as soon as it is '
+                                                 'built, without writing shards to the cache.')
+    pipeline_parser.add_argument('-f', '--file', required=True, type=str,
+                                 help='Xml dump, optionally compressed (.gz, .bz2 or .7z)')
+    pipeline_parser.add_argument('--url', required=True, type=str,
+                                 help='Api entry point of the wiki (found on [[Special:Version]])')
+    pipeline_parser.add_argument('--username', required=True, type=str)
+    pipeline_parser.add_argument('--password', required=True, type=str)
+    pipeline_parser.add_argument('--prefix', required=True, type=str, help="Interwiki prefix")
+    pipeline_parser.add_argument('--summary', default="Import xml dump", type=str,
+                                 help="Summary of this import")
+    pipeline_parser.add_argument('--gzip', action='store_true',
+                                 help='Upload gzip-compressed shards; the size limit applies to the compressed size.')
+    pipeline_parser.add_argument('--max-attempts', default=3, type=int,
+                                 help="Attempts per shard before it is saved to the cache for a later import")
+    add_filter_arguments(pipeline_parser)
+
+    index_parser = subparsers.add_parser('index',
+                                         help='Write a sqlite index of the byte offsets of every page and revision '
+                                              'next to an uncompressed xml file. Zero-copy sharding and page '
+                                              'lookups use it instead of scanning the file.')
+    index_parser.add_argument('-f', '--file', required=True, type=str)
+
+    page_parser = subparsers.add_parser('page', help='Print the xml of a single page of an indexed xml file.')
+    page_parser.add_argument('-f', '--file', required=True, type=str)
+    page_key = page_parser.add_mutually_exclusive_group(required=True)
+    page_key.add_argument('--title', type=str)
+    page_key.add_argument('--id', type=int, help='Page id')
 
     clean_parser = subparsers.add_parser('clean', help='Clean xml files in the cache.')
     args = parser.parse_args()
 
     def shard_wrapper():
         file = Path(args.file)
-        results = shard_file(file)
+        results = shard_with_options(file, args)
         logger.info(f"Sharded the original into {len(results)} files")
         logger.info(f"These filse are: {', '.join(r.name for r in results)}")
 
+    def batch_wrapper():
+        from importing.batch_sharder import expand_inputs, shard_batch
+        from importing.dump_generator import parse_size
+        files = expand_inputs(args.input)
+        if not files:
+            logger.error(f"No dumps found for {args.input}. Aborting.")
+            exit(1)
+        results = shard_batch(files, args, args.workers, parse_size(args.memory_budget))
+        if len(results) != len(files):
+            exit(1)
+
     def import_xml_wrapper():
-        files = list(xml_cache_dir.glob("*.xml"))
+        from importing.shard_importer import import_shards
+        files = list_shards()
         logger.info(f"Found {len(files)} xml files in the cache")
+        if not args.skip_validation:
+            from importing.shard_validator import validate_shards
+            files = validate_shards(files)
         session = login(args.url, args.username, args.password)
-        for file in files:
-            logger.info(f"Processing {file.name}")
-            result = import_xml(file, args.prefix, args.summary, session)
-            if result:
-                logger.info(f"Successfully imported {file.name}, deleting it from the cache")
-                file.unlink()
-            else:
-                logger.error(f"Failed to import {file.name}. Skpping...")
-                continue
+        import_shards(files, args.prefix, args.summary, session,
+                      parallelism=args.parallel, max_attempts=args.max_attempts)
+
+    def pipeline_wrapper():
+        from importing.import_pipeline import import_dump
+        file = Path(args.file)
+        page_filter = page_filter_from_args(args, file)
+        session = login(args.url, args.username, args.password)
+        if not import_dump(file, args.prefix, args.summary, session, compress=args.gzip,
+                           page_filter=page_filter, max_attempts=args.max_attempts):
+            exit(1)
+
+    def verify_wrapper():
+        from importing.import_verifier import verify_import
+        if args.username is not None:
+            session = login(args.url, args.username, args.password).session
+        else:
+            session = requests.Session()
+        if not verify_import(session, args.url, args.parallel, args.revision_ids):
+            exit(1)
+
+    def validate_wrapper():
+        from importing.shard_validator import validate_shards
+        files = list_shards()
+        if len(validate_shards(files, args.workers)) != len(files):
+            exit(1)
+
+    def index_wrapper():
+        from importing.dump_index import build_index
+        file = Path(args.file)
+        if is_compressed(file):
+            logger.error("Byte offsets are only meaningful in an uncompressed file. Aborting.")
+            exit(1)
+        build_index(file)
+
+    def page_wrapper():
+        from importing.dump_index import find_page, read_page
+        file = Path(args.file)
+        if is_compressed(file):
+            logger.error("Pages can only be looked up by offset in an uncompressed file. Aborting.")
+            exit(1)
+        page = find_page(file, title=args.title, page_id=args.id)
+        if page is None:
+            logger.error(f"Page not found in {file.name}.")
+            exit(1)
+        sys.stdout.buffer.write(read_page(file, page))
 
     def clean():
         shutil.rmtree(xml_cache_dir, ignore_errors=True)
@@ -264,7 +778,13 @@ def main():
 
     dispatcher = {
         "shard": shard_wrapper,
+        "batch": batch_wrapper,
         "import": import_xml_wrapper,
+        "pipeline": pipeline_wrapper,
+        "verify": verify_wrapper,
+        "validate": validate_wrapper,
+        "index": index_wrapper,
+        "page": page_wrapper,
         "clean": clean
     }
     dispatcher[args.command]()
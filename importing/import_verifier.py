@@ -0,0 +1,208 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+from requests import Session
+
+from importing.dump_io import open_dump
+from importing.import_sharder import DumpReader, ParsedPage, ShardWriter, shard_sort_key, xml_cache_dir, logger
+from importing.shard_importer import Manifest, imported_dir
+from importing.target_wiki import TITLES_PER_REQUEST, batched, fetch_latest_timestamps, fetch_revisions
+from utils.general_utils import throttle
+
+report_file = xml_cache_dir / "verification.json"
+# Shards with the missing pages are written to the cache under this name, where the import subcommand finds them
+MISSING_SHARD_NAME = "missing"
+
+# Minimum seconds between two api requests, over all threads
+REQUEST_DELAY = 0.5
+
+
+@dataclass
+class DumpRevision:
+    id: int | None
+    timestamp: str | None
+
+
+@dataclass
+class MissingPage:
+    title: str
+    shards: list[str]
+    revisions: int
+    missing_revisions: int
+    # "page" if the target does not have the page at all, "revisions" if it lacks some of its revisions
+    reason: str
+
+
+@dataclass
+class VerificationReport:
+    shards: int = 0
+    pages: int = 0
+    revisions: int = 0
+    # Shards the manifest does not list as imported, or that are no longer in the imported directory
+    unverified_shards: list[str] = field(default_factory=list)
+    # Shards for which the wiki reported importing fewer revisions than the shard holds
+    short_imports: list[str] = field(default_factory=list)
+    missing: list[MissingPage] = field(default_factory=list)
+
+    @property
+    def missing_revisions(self) -> int:
+        return sum(page.missing_revisions for page in self.missing)
+
+    def save(self, file: Path = report_file) -> None:
+        with open(file, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, indent=4, ensure_ascii=False)
+
+    def log(self) -> None:
+        logger.info(f"Checked {self.pages} pages and {self.revisions} revisions in {self.shards} shards: "
+                    f"{len(self.missing)} pages and {self.missing_revisions} revisions are missing on the target.")
+        if self.unverified_shards:
+            logger.warning(f"{len(self.unverified_shards)} shards could not be verified: "
+                           f"{', '.join(self.unverified_shards)}")
+        if self.short_imports:
+            logger.warning(f"The wiki reported fewer revisions than the shard holds for: "
+                           f"{', '.join(self.short_imports)}")
+
+
+def imported_shards(manifest: Manifest, report: VerificationReport) -> list[Path]:
+    files = []
+    for name, record in sorted(manifest.records.items()):
+        file = imported_dir / name
+        if record.status != "done" or not file.exists():
+            report.unverified_shards.append(name)
+            continue
+        files.append(file)
+    # Shard order, so that the revisions of split pages stay in order
+    return sorted(files, key=shard_sort_key)
+
+
+def read_shard_pages(files: list[Path], manifest: Manifest,
+                     report: VerificationReport) -> dict[str, tuple[list[str], list[DumpRevision]]]:
+    """
+    Shards and revisions of every page in the shards. Pages split over several shards are merged.
+    """
+    pages: dict[str, tuple[list[str], list[DumpRevision]]] = {}
+    for file in files:
+        revisions = 0
+        with open_dump(file) as f:
+            for page in DumpReader(f).pages():
+                shards, page_revisions = pages.setdefault(page.title, ([], []))
+                shards.append(file.name)
+                page_revisions.extend(DumpRevision(r.id, r.timestamp) for r in page.revisions)
+                revisions += len(page.revisions)
+        if manifest.get(file.name).revisions < revisions:
+            report.short_imports.append(file.name)
+        report.shards += 1
+    report.pages = len(pages)
+    report.revisions = sum(len(revisions) for _, revisions in pages.values())
+    return pages
+
+
+def query_concurrently(function, session: Session, url: str, items: list, parallelism: int) -> dict:
+    """
+    Run a batched api lookup with one request per batch, several at a time but throttled to REQUEST_DELAY.
+    """
+    def lookup(batch: list) -> dict:
+        throttle(REQUEST_DELAY)
+        return function(session, url, batch)
+
+    result = {}
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        for batch_result in executor.map(lookup, batched(items, TITLES_PER_REQUEST)):
+            result.update(batch_result)
+    return result
+
+
+def find_missing(session: Session, url: str, parallelism: int = 4,
+                 check_revision_ids: bool = False) -> tuple[VerificationReport, dict[str, set[int]]]:
+    """
+    Compare the shards the manifest lists as imported with the target wiki.
+    Pages are looked up by title: a page is missing if the target does not have it, and its revisions
+    are missing if they are newer than the target's latest revision. With check_revision_ids, the other
+    revisions are also looked up by id, which is only meaningful if the target kept the dump's revision ids.
+    Returns the report and, per page with something missing, the indices of its missing revisions.
+    """
+    manifest = Manifest()
+    report = VerificationReport()
+    pages = read_shard_pages(imported_shards(manifest, report), manifest, report)
+    on_target = query_concurrently(fetch_latest_timestamps, session, url, list(pages), parallelism)
+    missing: dict[str, set[int]] = {}
+    for title, (_, revisions) in pages.items():
+        latest = on_target.get(title)
+        if latest is None:
+            missing[title] = set(range(len(revisions)))
+            continue
+        newer = {index for index, revision in enumerate(revisions) if (revision.timestamp or "") > latest}
+        if newer:
+            missing[title] = newer
+
+    if check_revision_ids:
+        ids = [revision.id for title, (_, revisions) in pages.items() if title in on_target
+               for revision in revisions if revision.id is not None]
+        found = query_concurrently(fetch_revisions, session, url, ids, parallelism)
+        for title, (_, revisions) in pages.items():
+            if title not in on_target:
+                continue
+            for index, revision in enumerate(revisions):
+                if revision.id is None:
+                    continue
+                target = found.get(revision.id)
+                if target is None or target[1] != revision.timestamp:
+                    missing.setdefault(title, set()).add(index)
+
+    for title, indices in missing.items():
+        shards, revisions = pages[title]
+        report.missing.append(MissingPage(title, shards, len(revisions), len(indices),
+                                          "revisions" if title in on_target else "page"))
+    return report, missing
+
+
+def write_missing_shards(report: VerificationReport, missing: dict[str, set[int]],
+                         output_dir: Path = xml_cache_dir) -> list[Path]:
+    """
+    Shards with only the missing pages and revisions, ready to be imported.
+    Pages from dumps with different headers go to different shards.
+    """
+    shards = sorted({imported_dir / shard for page in report.missing for shard in page.shards}, key=shard_sort_key)
+    # Index of the next revision of every page, over all its shards
+    seen: dict[str, int] = {}
+    writers: dict[str, ShardWriter] = {}
+    for shard in shards:
+        with open_dump(shard) as f:
+            reader = DumpReader(f)
+            for page in reader.pages():
+                if page.title not in missing:
+                    continue
+                first = seen.get(page.title, 0)
+                seen[page.title] = first + len(page.revisions)
+                revisions = [revision for index, revision in enumerate(page.revisions, first)
+                             if index in missing[page.title]]
+                if not revisions:
+                    continue
+                writer = writers.get(reader.template_start)
+                if writer is None:
+                    name = MISSING_SHARD_NAME
+                    if writers:
+                        name += "-" + hashlib.sha1(reader.template_start.encode("utf-8")).hexdigest()[:8]
+                    writer = ShardWriter(name, reader.template_start, reader.shard_template_end,
+                                         output_dir=output_dir)
+                    writers[reader.template_start] = writer
+                writer.add(ParsedPage(page.start_tag, revisions, page.end_tag))
+    return [file for writer in writers.values() for file in writer.close()]
+
+
+def verify_import(session: Session, url: str, parallelism: int = 4, check_revision_ids: bool = False) -> bool:
+    """
+    Check the imported shards against the target, save the report and write shards with whatever is missing.
+    Returns whether nothing is missing.
+    """
+    report, missing = find_missing(session, url, parallelism, check_revision_ids)
+    report.save()
+    report.log()
+    logger.info(f"Saved the report to {report_file}")
+    if missing:
+        files = write_missing_shards(report, missing)
+        logger.info(f"Wrote the missing pages to {', '.join(file.name for file in files)}")
+    return not missing and not report.unverified_shards
@@ -0,0 +1,61 @@
+import uuid
+from collections.abc import Iterator
+from typing import BinaryIO
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MultipartBody:
+    """
+    multipart/form-data request body that reads the uploaded file while it is being sent.
+    Passing files= to requests would read the whole file into memory first.
+    """
+
+    def __init__(self, fields: dict[str, str], file_field: str, filename: str, content_type: str,
+                 source: BinaryIO):
+        self.boundary = uuid.uuid4().hex
+        head = []
+        for name, value in fields.items():
+            head.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+        head.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                    f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n')
+        self.head = "".join(head).encode("utf-8")
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.source = source
+        start = source.tell()
+        self.file_size = source.seek(0, 2) - start
+        source.seek(start)
+        self.chunks = self._chunks()
+        self.pending = memoryview(b"")
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        # requests sends a Content-Length header instead of a chunked body when the length is known
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def _chunks(self) -> Iterator[bytes]:
+        yield self.head
+        while chunk := self.source.read(CHUNK_SIZE):
+            yield chunk
+        yield self.tail
+
+    def __iter__(self) -> Iterator[bytes]:
+        if len(self.pending) > 0:
+            yield bytes(self.pending)
+            self.pending = memoryview(b"")
+        yield from self.chunks
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b"".join(self)
+        while len(self.pending) == 0:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return b""
+            self.pending = memoryview(chunk)
+        result = bytes(self.pending[:size])
+        self.pending = self.pending[size:]
+        return result
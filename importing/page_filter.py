@@ -0,0 +1,110 @@
+import re
+from collections.abc import Collection, Iterable, Iterator, Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from importing.dump_io import open_dump
+from importing.import_sharder import DumpReader, ParsedPage, logger
+
+
+@dataclass
+class PageFilter:
+    """
+    Which pages and revisions of a dump end up in the shards. Unset fields keep everything.
+    """
+    namespaces: set[int] | None = None
+    # Searched for in the full title, including the namespace prefix
+    title_pattern: re.Pattern | None = None
+    # Revisions older than this ISO 8601 timestamp or date are dropped
+    since: str | None = None
+    # Only this many of the newest revisions of every page are kept
+    last_revisions: int | None = None
+    # e.g. pages the target wiki already has
+    skip_titles: Collection[str] = field(default_factory=frozenset)
+    # Per title, only revisions newer than this timestamp are kept, e.g. the target wiki's latest revision
+    newer_than: Mapping[str, str] = field(default_factory=dict)
+
+    @property
+    def is_empty(self) -> bool:
+        return (self.namespaces is None and self.title_pattern is None and self.since is None
+                and self.last_revisions is None and len(self.skip_titles) == 0 and len(self.newer_than) == 0)
+
+    @property
+    def filters_revisions(self) -> bool:
+        return self.since is not None or self.last_revisions is not None or len(self.newer_than) > 0
+
+    def keep_page(self, title: str, namespace: int | None) -> bool:
+        if title in self.skip_titles:
+            return False
+        if self.namespaces is not None and namespace not in self.namespaces:
+            return False
+        if self.title_pattern is not None and self.title_pattern.search(title) is None:
+            return False
+        return True
+
+    def apply(self, page: ParsedPage) -> ParsedPage | None:
+        """
+        The page with only the revisions to keep, or None if nothing of it is kept.
+        """
+        if not self.keep_page(page.title, page.namespace):
+            return None
+        if not self.filters_revisions:
+            return page
+        revisions = page.revisions
+        cutoff = self.newer_than.get(page.title)
+        if cutoff is not None:
+            revisions = [r for r in revisions if (r.timestamp or "") > cutoff]
+        if self.since is not None:
+            revisions = [r for r in revisions if (r.timestamp or "") >= self.since]
+        if self.last_revisions is not None:
+            revisions = revisions[-self.last_revisions:] if self.last_revisions > 0 else []
+        if len(revisions) == 0:
+            return None
+        return ParsedPage(page.start_tag, revisions, page.end_tag)
+
+
+@dataclass
+class FilterReport:
+    pages: int = 0
+    kept_pages: int = 0
+    revisions: int = 0
+    kept_revisions: int = 0
+    size: int = 0
+    kept_size: int = 0
+
+    def add(self, page: ParsedPage, kept: ParsedPage | None) -> None:
+        self.pages += 1
+        self.revisions += len(page.revisions)
+        self.size += page.size
+        if kept is not None:
+            self.kept_pages += 1
+            self.kept_revisions += len(kept.revisions)
+            self.kept_size += kept.size
+
+    def log(self) -> None:
+        saved = 1 - self.kept_size / self.size if self.size > 0 else 0
+        logger.info(f"Filter keeps {self.kept_pages} of {self.pages} pages and "
+                    f"{self.kept_revisions} of {self.revisions} revisions: "
+                    f"{self.kept_size / 1e6:.1f}MB of {self.size / 1e6:.1f}MB ({saved:.1%} smaller).")
+
+
+def filter_pages(pages: Iterable[ParsedPage], page_filter: PageFilter | None,
+                 report: FilterReport | None = None) -> Iterator[ParsedPage]:
+    for page in pages:
+        kept = page_filter.apply(page) if page_filter is not None else page
+        if report is not None:
+            report.add(page, kept)
+        if kept is not None:
+            yield kept
+
+
+def report_filter(file: Path, page_filter: PageFilter) -> FilterReport:
+    """
+    Dry run of the filter over a dump, so the reduction is known before any shard is written.
+    """
+    report = FilterReport()
+    with open_dump(file) as f:
+        for _ in filter_pages(DumpReader(f).pages(), page_filter, report):
+            pass
+    report.log()
+    return report
@@ -0,0 +1,227 @@
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+
+import requests
+
+from importing.import_sharder import import_xml, shard_sort_key, xml_cache_dir, logger
+from utils.general_utils import SessionInfo, get_csrf_token
+
+manifest_file = xml_cache_dir / "manifest.json"
+# Imported shards are kept here instead of being deleted, so that they can be checked against the wiki later
+imported_dir = xml_cache_dir / "imported"
+
+TITLE_PATTERN = re.compile(rb"<(?:ns\d+:)?title>(.*?)</(?:ns\d+:)?title>")
+
+# Seconds to wait before the second attempt of a shard; doubled after every further failure
+BACKOFF_SECONDS = 10
+# Rejected csrf tokens are refreshed and retried without using up an attempt, at most this often per shard
+MAX_TOKEN_REFRESHES = 5
+
+
+@dataclass
+class ShardRecord:
+    sha1: str
+    size: int
+    # one of pending, done, failed
+    status: str = "pending"
+    attempts: int = 0
+    pages: int = 0
+    revisions: int = 0
+    error: str | None = None
+    updated: str | None = None
+
+
+class Manifest:
+    """
+    Status of every shard, keyed by file name and saved after every change.
+    """
+
+    def __init__(self, file: Path = manifest_file):
+        self.file = file
+        self.lock = Lock()
+        self.records: dict[str, ShardRecord] = {}
+        if file.exists():
+            with open(file, "r", encoding="utf-8") as f:
+                self.records = {name: ShardRecord(**record) for name, record in json.load(f).items()}
+
+    def get(self, name: str) -> ShardRecord | None:
+        with self.lock:
+            return self.records.get(name)
+
+    def register(self, name: str, sha1: str, size: int) -> ShardRecord:
+        """
+        Record for a shard, started afresh if the shard's content changed since it was last seen.
+        """
+        with self.lock:
+            record = self.records.get(name)
+            if record is None or record.sha1 != sha1:
+                record = ShardRecord(sha1, size)
+                self.records[name] = record
+                self._save()
+            return record
+
+    def update(self, name: str, **changes) -> None:
+        with self.lock:
+            record = self.records[name]
+            for key, value in changes.items():
+                setattr(record, key, value)
+            record.updated = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            self._save()
+
+    def _save(self) -> None:
+        temp_file = self.file.with_suffix(".tmp")
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump({name: asdict(record) for name, record in self.records.items()}, f, indent=4)
+        os.replace(temp_file, self.file)
+
+
+class CsrfToken:
+    """
+    Csrf token shared by all uploads. It is only fetched again when the wiki rejects it.
+    """
+
+    def __init__(self, session_info: SessionInfo):
+        self.session_info = session_info
+        self.lock = Lock()
+        self.value: str | None = None
+
+    def get(self) -> str:
+        with self.lock:
+            if self.value is None:
+                self.value = get_csrf_token(self.session_info.session, self.session_info.url)
+            return self.value
+
+    def refresh(self, rejected: str) -> str:
+        with self.lock:
+            # Another upload may have refreshed it already
+            if self.value == rejected:
+                self.value = get_csrf_token(self.session_info.session, self.session_info.url)
+            return self.value
+
+
+def scan_shard(file: Path) -> tuple[str, set[bytes]]:
+    """
+    Checksum of a shard and the titles of the pages in it. The checksum is of the file as uploaded,
+    the titles of its xml, so gzip shards are decompressed for them.
+    """
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        sha1 = hashlib.sha1(data).hexdigest()
+        if not file.name.endswith(".gz"):
+            return sha1, set(TITLE_PATTERN.findall(data))
+    titles = set()
+    with gzip.open(file, "rb") as f:
+        # Title elements are on their own line in every shard the sharders write
+        for line in f:
+            titles.update(TITLE_PATTERN.findall(line))
+    return sha1, titles
+
+
+def group_dependent_shards(titles: dict[Path, set[bytes]]) -> list[list[Path]]:
+    """
+    Shards that share a page hold parts of a split page and must be imported one after another
+    in shard order. Every other shard can be imported at the same time as the rest.
+    """
+    parent = {file: file for file in titles}
+
+    def find(file: Path) -> Path:
+        while parent[file] != file:
+            parent[file] = parent[parent[file]]
+            file = parent[file]
+        return file
+
+    owner: dict[bytes, Path] = {}
+    for file, shard_titles in titles.items():
+        for title in shard_titles:
+            if title in owner:
+                parent[find(file)] = find(owner[title])
+            else:
+                owner[title] = file
+    groups: dict[Path, list[Path]] = {}
+    for file in titles:
+        groups.setdefault(find(file), []).append(file)
+    result = [sorted(group, key=shard_sort_key) for group in groups.values()]
+    result.sort(key=lambda group: shard_sort_key(group[0]))
+    return result
+
+
+def import_shard(file: Path, prefix: str, summary: str, session_info: SessionInfo,
+                 token: CsrfToken, manifest: Manifest, max_attempts: int) -> bool:
+    record = manifest.get(file.name)
+    delay = 0
+    attempt = 0
+    refreshes = 0
+    while attempt < max_attempts:
+        time.sleep(delay)
+        value = token.get()
+        try:
+            outcome = import_xml(file, prefix, summary, session_info, value)
+        except requests.RequestException as e:
+            logger.error(f"Failed to import {file.name}: {e}")
+            manifest.update(file.name, status="failed", attempts=record.attempts + 1, error=str(e))
+            delay = BACKOFF_SECONDS * 2 ** attempt
+            attempt += 1
+            continue
+        if outcome.code == "badtoken" and refreshes < MAX_TOKEN_REFRESHES:
+            # A stale token is not the shard's fault, so try again right away without counting the attempt
+            token.refresh(value)
+            refreshes += 1
+            delay = 0
+            continue
+        delay = BACKOFF_SECONDS * 2 ** attempt
+        attempt += 1
+        if not outcome:
+            manifest.update(file.name, status="failed", attempts=record.attempts + 1, error=outcome.error)
+            continue
+        manifest.update(file.name, status="done", attempts=record.attempts + 1, error=None,
+                        pages=outcome.pages, revisions=outcome.revisions)
+        imported_dir.mkdir(parents=True, exist_ok=True)
+        shutil.move(file, imported_dir / file.name)
+        return True
+    return False
+
+
+def import_shards(files: list[Path], prefix: str, summary: str, session_info: SessionInfo,
+                  parallelism: int = 2, max_attempts: int = 3) -> bool:
+    """
+    Import shards with up to `parallelism` uploads at a time. Progress is kept in the manifest:
+    shards that are already imported are skipped and failed ones are tried again.
+    Returns whether every shard is imported.
+    """
+    manifest = Manifest()
+    titles: dict[Path, set[bytes]] = {}
+    for file in files:
+        sha1, shard_titles = scan_shard(file)
+        record = manifest.register(file.name, sha1, file.stat().st_size)
+        if record.status == "done":
+            logger.info(f"{file.name} is already imported. Skipping...")
+            continue
+        titles[file] = shard_titles
+    token = CsrfToken(session_info)
+
+    def import_group(group: list[Path]) -> int:
+        for index, file in enumerate(group):
+            logger.info(f"Processing {file.name}")
+            if not import_shard(file, prefix, summary, session_info, token, manifest, max_attempts):
+                blocked = len(group) - index - 1
+                if blocked > 0:
+                    logger.error(f"Skipping the {blocked} shards that continue the pages of {file.name}.")
+                return index
+        return len(group)
+
+    groups = group_dependent_shards(titles)
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        imported = sum(executor.map(import_group, groups))
+    logger.info(f"Imported {imported} of {len(titles)} remaining shards "
+                f"({len(files) - len(titles)} were already imported).")
+    return imported == len(titles)
@@ -0,0 +1,263 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from importing.dump_io import open_dump, dump_stem
+from importing.import_sharder import DumpReader, ParsedPage, LENGTH_TARGET_LIMIT, LENGTH_HARD_LIMIT, \
+    DEFAULT_TEMPLATE_END, closing_template, xml_cache_dir, logger
+from importing.page_filter import PageFilter, FilterReport, filter_pages
+
+
+@dataclass(slots=True)
+class PageSizes:
+    """
+    Byte sizes of a page: its start and end tags together, and every revision in order.
+    """
+    tag_size: int
+    revision_sizes: list[int]
+
+    @property
+    def size(self) -> int:
+        return self.tag_size + sum(self.revision_sizes)
+
+
+@dataclass(slots=True)
+class PlannedPart:
+    """
+    A whole page (revisions is None) or a run of consecutive revisions of a page.
+    """
+    page: int
+    size: int
+    revisions: range | None = None
+
+
+ShardPlan = list[list[PlannedPart]]
+
+
+def split_page(index: int, page: PageSizes, budget: int) -> list[PlannedPart]:
+    """
+    Split a page that does not fit in a shard into runs of consecutive revisions.
+    """
+    revision_budget = budget - page.tag_size
+    parts = []
+    start = 0
+    size = 0
+    for i, revision_size in enumerate(page.revision_sizes):
+        if revision_size > revision_budget:
+            logger.error(f"A revision has size {revision_size}, greater than the max allowed size. Aborting.")
+            exit(1)
+        if i > start and size + revision_size > revision_budget:
+            parts.append(PlannedPart(index, page.tag_size + size, range(start, i)))
+            start, size = i, 0
+        size += revision_size
+    parts.append(PlannedPart(index, page.tag_size + size, range(start, len(page.revision_sizes))))
+    return parts
+
+
+def plan_greedy(pages: list[PageSizes], budget: int) -> ShardPlan:
+    """
+    Fill shards in document order, like partition_by_size. A page that does not fit in the
+    current shard closes it, and every part of a split page gets a shard of its own.
+    """
+    shards: ShardPlan = []
+    current: list[PlannedPart] = []
+    current_size = 0
+    for index, page in enumerate(pages):
+        size = page.size
+        if size > budget:
+            if current:
+                shards.append(current)
+                current, current_size = [], 0
+            shards.extend([part] for part in split_page(index, page, budget))
+            continue
+        if current and current_size + size > budget:
+            shards.append(current)
+            current, current_size = [], 0
+        current.append(PlannedPart(index, size))
+        current_size += size
+    if current:
+        shards.append(current)
+    return shards
+
+
+class _FirstFitTree:
+    """
+    Segment tree over the remaining capacity of each shard. Finds the first shard after a
+    given index with enough room in O(log n), so packing a million pages stays fast.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.leaves = 1
+        self.tree = [0, 0]
+        self.count = 0
+
+    def _grow(self) -> None:
+        old_leaves = self.leaves
+        old = [self.tree[old_leaves + i] for i in range(old_leaves)]
+        self.leaves *= 2
+        self.tree = [0] * (2 * self.leaves)
+        for i, remaining in enumerate(old):
+            self.tree[self.leaves + i] = remaining
+        for node in range(self.leaves - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def _set(self, index: int, remaining: int) -> None:
+        node = self.leaves + index
+        self.tree[node] = remaining
+        node //= 2
+        while node >= 1:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def _first_fit(self, node: int, lo: int, hi: int, size: int, after: int) -> int | None:
+        if self.tree[node] < size or hi <= after + 1 or lo >= self.count:
+            return None
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        result = self._first_fit(2 * node, lo, mid, size, after)
+        if result is None:
+            result = self._first_fit(2 * node + 1, mid, hi, size, after)
+        return result
+
+    def place(self, size: int, after: int = -1) -> int:
+        """
+        Put an item in the first shard with index > after that has room for it, opening a new
+        shard if there is none. Returns the shard's index.
+        """
+        index = self._first_fit(1, 0, self.leaves, size, after)
+        if index is None:
+            if self.count == self.leaves:
+                self._grow()
+            index = self.count
+            self.count += 1
+            remaining = self.capacity
+        else:
+            remaining = self.tree[self.leaves + index]
+        self._set(index, remaining - size)
+        return index
+
+
+def plan_first_fit_decreasing(pages: list[PageSizes], budget: int) -> ShardPlan:
+    """
+    Pack pages into as few shards as possible with first-fit decreasing.
+    Parts of a split page are placed first, in revision order, each in a later shard than the
+    part before it, so importing the shards in order keeps every page's history in order.
+    Within a shard, parts are written in document order.
+    """
+    whole_pages: list[PlannedPart] = []
+    split_pages: list[list[PlannedPart]] = []
+    for index, page in enumerate(pages):
+        size = page.size
+        if size > budget:
+            split_pages.append(split_page(index, page, budget))
+        else:
+            whole_pages.append(PlannedPart(index, size))
+
+    tree = _FirstFitTree(budget)
+    shards: ShardPlan = []
+
+    def add(part: PlannedPart, after: int = -1) -> int:
+        shard = tree.place(part.size, after)
+        if shard == len(shards):
+            shards.append([])
+        shards[shard].append(part)
+        return shard
+
+    split_pages.sort(key=lambda parts: sum(p.size for p in parts), reverse=True)
+    for parts in split_pages:
+        previous = -1
+        for part in parts:
+            previous = add(part, previous)
+    whole_pages.sort(key=lambda p: p.size, reverse=True)
+    for part in whole_pages:
+        add(part)
+    for shard in shards:
+        shard.sort(key=lambda p: (p.page, p.revisions.start if p.revisions is not None else 0))
+    return shards
+
+
+def plan_shards(pages: list[PageSizes], budget: int, planner: str = "ffd") -> ShardPlan:
+    greedy = plan_greedy(pages, budget)
+    if planner == "greedy":
+        logger.info(f"Greedy planner: {len(greedy)} shards.")
+        return greedy
+    packed = plan_first_fit_decreasing(pages, budget)
+    logger.info(f"First-fit decreasing planner: {len(packed)} shards (greedy planner: {len(greedy)} shards).")
+    return packed
+
+
+def measure_page(page: ParsedPage) -> PageSizes:
+    return PageSizes(len(page.start_tag.encode("utf-8")) + len(page.end_tag.encode("utf-8")),
+                     [r.size for r in page.revisions])
+
+
+class PlannedShardWriter:
+    """
+    Writes a dump into shards according to a plan in a single streaming pass.
+    All shards are open at once; each page is appended to the shards the plan assigns it to.
+    """
+
+    def __init__(self, name: str, template_start: str, plan: ShardPlan,
+                 template_end: str = DEFAULT_TEMPLATE_END, output_dir: Path = xml_cache_dir):
+        self.template_start = template_start.encode("utf-8")
+        self.template_end = template_end.encode("utf-8")
+        self.files = [output_dir / f"{name}_{number}.xml" for number in range(len(plan))]
+        self.handles: list[BinaryIO | None] = [None] * len(plan)
+        self.assignments: dict[int, list[tuple[int, range | None]]] = {}
+        for number, shard in enumerate(plan):
+            for part in shard:
+                self.assignments.setdefault(part.page, []).append((number, part.revisions))
+
+    def _handle(self, number: int) -> BinaryIO:
+        handle = self.handles[number]
+        if handle is None:
+            handle = open(self.files[number], "wb")
+            handle.write(self.template_start)
+            self.handles[number] = handle
+        return handle
+
+    def add(self, index: int, page: ParsedPage) -> None:
+        for number, revisions in self.assignments.get(index, []):
+            part = page
+            if revisions is not None:
+                part = ParsedPage(page.start_tag, page.revisions[revisions.start:revisions.stop], page.end_tag)
+            self._handle(number).write(str(part).encode("utf-8"))
+
+    def close(self) -> list[Path]:
+        for number, handle in enumerate(self.handles):
+            handle = self._handle(number)
+            handle.write(self.template_end)
+            size = handle.tell()
+            handle.close()
+            assert size <= LENGTH_HARD_LIMIT, f"File {self.files[number].name} has size {size}, greater than the configured maximum."
+        logger.info(f"Created {len(self.files)} shards.")
+        return self.files
+
+
+def shard_file_planned(original_file: Path, planner: str = "ffd", max_size: int = LENGTH_TARGET_LIMIT,
+                       page_filter: PageFilter | None = None, output_dir: Path = xml_cache_dir,
+                       name: str | None = None) -> list[Path]:
+    """
+    Two streaming passes over the dump: the first measures every page and revision,
+    the second writes the shards chosen by the planner. Compressed dumps are decompressed twice.
+    """
+    with open_dump(original_file) as f:
+        reader = DumpReader(f)
+        template_start = reader.template_start
+        report = FilterReport()
+        pages = [measure_page(page) for page in filter_pages(reader.pages(), page_filter, report)]
+    logger.info(f"Measured {len(pages)} pages in {original_file.name}.")
+    if page_filter is not None:
+        report.log()
+    template_end = closing_template(template_start)
+    budget = max_size - len(template_start.encode("utf-8")) - len(template_end.encode("utf-8"))
+    plan = plan_shards(pages, budget, planner)
+    with open_dump(original_file) as f:
+        reader = DumpReader(f)
+        writer = PlannedShardWriter(name or dump_stem(original_file), reader.template_start, plan,
+                                    template_end, output_dir=output_dir)
+        for index, page in enumerate(filter_pages(reader.pages(), page_filter)):
+            writer.add(index, page)
+        return writer.close()
@@ -0,0 +1,166 @@
+import gzip
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+from xml.parsers import expat
+
+from importing.import_sharder import LENGTH_HARD_LIMIT, xml_cache_dir, logger
+
+quarantine_dir = xml_cache_dir / "quarantine"
+
+CHUNK_SIZE = 1024 * 1024
+# Stop collecting errors after this many; the shard is rejected either way
+MAX_ERRORS = 20
+
+# Children every element needs for the import to make sense, from the export schema
+# (https://www.mediawiki.org/xml/export-0.11.xsd)
+REQUIRED_CHILDREN = {
+    "page": ("title", "revision"),
+    "revision": ("timestamp", "contributor", "text"),
+}
+
+
+@dataclass
+class ValidationResult:
+    name: str
+    size: int
+    pages: int = 0
+    revisions: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+
+class _ExportChecker:
+    """
+    expat handlers that check the structure of an export while it is being parsed.
+    """
+
+    def __init__(self, result: ValidationResult):
+        self.result = result
+        self.stack: list[str] = []
+        # Names of the children seen so far and the depth, for each open element that has required children
+        self.children: list[set[str]] = []
+        self.children_depth: list[int] = []
+        self.parser = expat.ParserCreate(namespace_separator=" ")
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+
+    def error(self, message: str) -> None:
+        if len(self.result.errors) < MAX_ERRORS:
+            self.result.errors.append(f"line {self.parser.CurrentLineNumber}: {message}")
+
+    def start(self, name: str, attributes) -> None:
+        name = name.rsplit(" ", 1)[-1]
+        if not self.stack and name != "mediawiki":
+            self.error(f"root element is <{name}>, not <mediawiki>")
+        if self.children and len(self.stack) == self.children_depth[-1] + 1:
+            self.children[-1].add(name)
+        if name == "page" and self.stack != ["mediawiki"]:
+            self.error("<page> outside of <mediawiki>")
+        if name == "revision" and self.stack[-1:] != ["page"]:
+            self.error("<revision> outside of <page>")
+        self.stack.append(name)
+        if name in REQUIRED_CHILDREN:
+            self.children.append(set())
+            self.children_depth.append(len(self.stack) - 1)
+
+    def end(self, name: str) -> None:
+        name = name.rsplit(" ", 1)[-1]
+        self.stack.pop()
+        if name in REQUIRED_CHILDREN:
+            seen = self.children.pop()
+            self.children_depth.pop()
+            missing = [child for child in REQUIRED_CHILDREN[name] if child not in seen]
+            if missing:
+                self.error(f"<{name}> without {', '.join(f'<{child}>' for child in missing)}")
+            if name == "page":
+                self.result.pages += 1
+            else:
+                self.result.revisions += 1
+
+    def feed(self, source: BinaryIO) -> None:
+        try:
+            while chunk := source.read(CHUNK_SIZE):
+                self.parser.Parse(chunk, False)
+                if len(self.result.errors) >= MAX_ERRORS:
+                    return
+            self.parser.Parse(b"", True)
+        except expat.ExpatError as e:
+            self.result.errors.append(f"not well-formed: {expat.ErrorString(e.code)} at line {e.lineno}, "
+                                      f"column {e.offset}")
+
+
+def validate_stream(name: str, source: BinaryIO, size: int) -> ValidationResult:
+    """
+    Check a shard while streaming it: its size, that it is well-formed xml, and that it has the
+    structure of a MediaWiki export. source is the shard as it will be uploaded.
+    """
+    result = ValidationResult(name, size)
+    if size > LENGTH_HARD_LIMIT:
+        result.errors.append(f"size {size} is greater than the maximum of {LENGTH_HARD_LIMIT}")
+    if name.endswith(".gz"):
+        source = gzip.GzipFile(fileobj=source, mode="rb")
+    try:
+        _ExportChecker(result).feed(source)
+    except (OSError, EOFError) as e:
+        # e.g. a truncated gzip stream
+        result.errors.append(f"cannot be read: {e}")
+    if result.ok and result.pages == 0:
+        result.errors.append("has no pages")
+    return result
+
+
+def validate_shard(file: Path) -> ValidationResult:
+    with open(file, "rb") as f:
+        return validate_stream(file.name, f, os.fstat(f.fileno()).st_size)
+
+
+def _write_errors(destination: Path, result: ValidationResult) -> None:
+    destination.with_name(destination.name + ".errors.txt").write_text("\n".join(result.errors) + "\n",
+                                                                        encoding="utf-8")
+
+
+def quarantine(file: Path, result: ValidationResult) -> Path:
+    """
+    Move a bad shard out of the way of the importer, with its errors next to it.
+    """
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    destination = quarantine_dir / file.name
+    shutil.move(file, destination)
+    _write_errors(destination, result)
+    return destination
+
+
+def quarantine_stream(name: str, source: BinaryIO, result: ValidationResult) -> Path:
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    destination = quarantine_dir / name
+    source.seek(0)
+    with open(destination, "wb") as f:
+        shutil.copyfileobj(source, f)
+    _write_errors(destination, result)
+    return destination
+
+
+def validate_shards(files: list[Path], workers: int | None = None) -> list[Path]:
+    """
+    Validate shards in a process pool and quarantine the bad ones. Returns the shards that passed.
+    """
+    if not files:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(validate_shard, files))
+    valid = []
+    for file, result in zip(files, results):
+        if result.ok:
+            valid.append(file)
+            continue
+        destination = quarantine(file, result)
+        logger.error(f"{file.name} is invalid and was moved to {destination}: {'; '.join(result.errors[:3])}")
+    logger.info(f"{len(valid)} of {len(files)} shards are valid.")
+    return valid
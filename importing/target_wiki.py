@@ -0,0 +1,105 @@
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import TypeVar
+
+from requests import Session
+
+from importing.dump_io import open_dump
+from importing.import_sharder import DumpReader, logger
+from utils.general_utils import headers
+
+# The api accepts at most 50 titles per query for normal accounts
+TITLES_PER_REQUEST = 50
+
+T = TypeVar("T")
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def fetch_latest_timestamps(session: Session, url: str, titles: Iterable[str]) -> dict[str, str]:
+    """
+    Timestamp of the latest revision of every title that exists on the target wiki.
+    Titles that do not exist are left out.
+    """
+    result: dict[str, str] = {}
+    for batch in batched(titles, TITLES_PER_REQUEST):
+        data = {
+            "action": "query",
+            "prop": "revisions",
+            "rvprop": "timestamp",
+            "titles": "|".join(batch),
+            "format": "json",
+            "formatversion": 2,
+        }
+        # Titles can be long, so they are sent in the body instead of the url
+        response = session.post(url, data=data, headers=headers).json()
+        query = response.get("query", {})
+        # The api reports a title under its normalized form, e.g. "Main page" for "main_page"
+        original = {entry["to"]: entry["from"] for entry in query.get("normalized", [])}
+        for page in query.get("pages", []):
+            if page.get("missing") or page.get("invalid") or not page.get("revisions"):
+                continue
+            title = original.get(page["title"], page["title"])
+            result[title] = page["revisions"][0]["timestamp"]
+    return result
+
+
+def fetch_revisions(session: Session, url: str, revision_ids: Iterable[int]) -> dict[int, tuple[str, str]]:
+    """
+    Title and timestamp of every revision id that exists on the target wiki.
+    """
+    result: dict[int, tuple[str, str]] = {}
+    for batch in batched(revision_ids, TITLES_PER_REQUEST):
+        data = {
+            "action": "query",
+            "prop": "revisions",
+            "rvprop": "ids|timestamp",
+            "revids": "|".join(str(revision_id) for revision_id in batch),
+            "format": "json",
+            "formatversion": 2,
+        }
+        response = session.post(url, data=data, headers=headers).json()
+        # Ids that do not exist are listed under "badrevids" and simply left out
+        for page in response.get("query", {}).get("pages", []):
+            for revision in page.get("revisions", []):
+                result[revision["revid"]] = (page["title"], revision["timestamp"])
+    return result
+
+
+def dump_latest_timestamps(file: Path) -> dict[str, str | None]:
+    with open_dump(file) as f:
+        reader = DumpReader(f)
+        return {page.title: page.latest_timestamp for page in reader.pages()}
+
+
+def find_target_timestamps(file: Path, session: Session, url: str) -> dict[str, str]:
+    """
+    Latest revision timestamp on the target wiki of every page in the dump that exists there.
+    """
+    with open_dump(file) as f:
+        titles = [page.title for page in DumpReader(f).pages()]
+    on_target = fetch_latest_timestamps(session, url, titles)
+    logger.info(f"{len(on_target)} of {len(titles)} pages exist on the target.")
+    return on_target
+
+
+def find_present_pages(file: Path, session: Session, url: str) -> set[str]:
+    """
+    Titles of the pages in the dump that the target wiki already has up to their latest revision.
+    """
+    in_dump = dump_latest_timestamps(file)
+    on_target = fetch_latest_timestamps(session, url, in_dump.keys())
+    present = {title for title, timestamp in in_dump.items()
+               if title in on_target and (timestamp is None or on_target[title] >= timestamp)}
+    logger.info(f"{len(on_target)} of {len(in_dump)} pages exist on the target; "
+                f"{len(present)} of them are up to date and will be skipped.")
+    return present
@@ -1,18 +1,55 @@
+import hashlib
+import io
+import mmap
+import os
+import re
 import sqlite3
-import sys
-from dataclasses import dataclass
+import time
+import zlib
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from functools import cache
 from pathlib import Path
+from typing import BinaryIO
 
-from bs4 import BeautifulSoup
+from lxml import etree
 
-from importing.import_sharder import parse_lines, ParsedPage, Revision
+from importing.dump_io import open_dump_binary, is_compressed, ordered_map
 from utils.db_utils import db_dir
+from utils.general_utils import get_logger
+
+logger = get_logger("xml_to_db")
+
+# Built after the data in bulk mode, since updating them for every row is slower than building them once
+SECONDARY_INDEXES = {
+    "pages_title": "pages(title)",
+    "revisions_page_id": "revisions(page_id)",
+}
+# Pages per transaction in bulk mode
+BULK_BATCH_SIZE = 5000
+BULK_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "MEMORY",
+    "temp_store": "MEMORY",
+    # In KiB when negative, i.e. 256MB
+    "cache_size": -256 * 1024,
+}
+TEXT_COMPRESSION_LEVEL = 6
+# Bytes of an uncompressed dump parsed by one task when parsing on several processes
+PARSE_TASK_SIZE = 16 * 1024 * 1024
+PAGE_START_PATTERN = re.compile(rb"<(?:[\w.-]+:)?page[\s>]")
+ROOT_START_PATTERN = re.compile(rb"<(?:([\w.-]+):)?mediawiki(?:\s[^>]*)?>")
+# Seconds between progress reports
+PROGRESS_INTERVAL = 10
 
 
 @cache
 def get_db():
     conn = sqlite3.connect(db_dir / "xml.sqlite")
+    # Lets the search index be filled from the compressed texts in sql
+    conn.create_function("decode_text", 2, decode_text, deterministic=True)
     return conn
 
 
@@ -27,14 +64,94 @@ def init_db():
     )
     """)
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS revisions (
+    CREATE TABLE IF NOT EXISTS texts (
+        sha1 TEXT PRIMARY KEY,
+        compression TEXT NOT NULL,
+        data BLOB NOT NULL
+    )
+    """)
+    create_revisions_table(cur, "revisions")
+    conn.commit()
+    migrate_inline_texts(conn)
+    create_indexes(conn)
+
+
+def create_revisions_table(cur: sqlite3.Cursor, name: str) -> None:
+    # The text of a revision is stored once per distinct content in texts, since most revisions of a page
+    # are near-identical and reverts are exact duplicates
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {name} (
         revision_id INTEGER PRIMARY KEY,
         page_id INTEGER REFERENCES pages(page_id) DEFERRABLE INITIALLY DEFERRED,
-        text TEXT NOT NULL,
+        text_sha1 TEXT NOT NULL REFERENCES texts(sha1),
         contributor TEXT NOT NULL,
         timestamp TEXT NOT NULL
     )
     """)
+
+
+def migrate_inline_texts(conn: sqlite3.Connection) -> None:
+    """
+    Move the texts of a database created before the texts table into it.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(revisions)")]
+    if "text" not in columns:
+        return
+    logger.info("Moving the revision texts into the texts table...")
+    cur = conn.cursor()
+    create_revisions_table(cur, "revisions_new")
+    for revision_id, page_id, text, contributor, timestamp in conn.execute(
+            "SELECT revision_id, page_id, text, contributor, timestamp FROM revisions"):
+        cur.execute("INSERT INTO revisions_new VALUES (?, ?, ?, ?, ?)",
+                    (revision_id, page_id, store_text(cur, text), contributor, timestamp))
+    # Renaming the old table instead would also rename the reference to it in pages
+    cur.execute("DROP TABLE revisions")
+    cur.execute("ALTER TABLE revisions_new RENAME TO revisions")
+    conn.commit()
+    # Give the space of the inline texts back to the file system
+    conn.execute("VACUUM")
+    logger.info("Moved the revision texts.")
+
+
+def store_text(cur: sqlite3.Cursor, text: str) -> str:
+    """
+    Save a text if it is not saved yet and return its key.
+    """
+    data = text.encode("utf-8")
+    sha1 = hashlib.sha1(data).hexdigest()
+    if cur.execute("SELECT 1 FROM texts WHERE sha1 = ?", (sha1,)).fetchone() is None:
+        compressed = zlib.compress(data, TEXT_COMPRESSION_LEVEL)
+        # Short texts can grow when compressed
+        if len(compressed) < len(data):
+            cur.execute("INSERT INTO texts VALUES (?, 'zlib', ?)", (sha1, compressed))
+        else:
+            cur.execute("INSERT INTO texts VALUES (?, 'none', ?)", (sha1, data))
+    return sha1
+
+
+def decode_text(compression: str, data: bytes) -> str:
+    if compression == "zlib":
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+
+def revision_text(revision_id: int) -> str | None:
+    row = get_db().execute("""
+    SELECT compression, data FROM revisions JOIN texts ON texts.sha1 = revisions.text_sha1
+    WHERE revision_id = ?
+    """, (revision_id,)).fetchone()
+    return decode_text(*row) if row is not None else None
+
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    for name, columns in SECONDARY_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+    conn.commit()
+
+
+def drop_indexes(conn: sqlite3.Connection) -> None:
+    for name in SECONDARY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
     conn.commit()
 
 
@@ -53,59 +170,332 @@ class XmlPage:
     revisions: list[XmlRevision]
 
 
-def parse_page_revision(revision: Revision) -> XmlRevision:
-    xml = "\n".join(revision.lines)
-    soup = BeautifulSoup(xml, "lxml")
-    revision_id = int(soup.find("id").text)
-    text = soup.find("text").text
-    username = soup.find("username")
-    if username is not None:
-        contributor = username.text
-    else:
-        ip = soup.find("ip")
-        if ip is not None:
-            contributor = ip
-        else:
-            contributor = "unknown"
-    timestamp = soup.find("timestamp").text
-    return XmlRevision(revision_id, text, contributor, timestamp)
+def local_name(element: etree._Element) -> str | None:
+    """
+    Tag of an element without its namespace, so that every export schema version is read the same way.
+    None for comments and processing instructions.
+    """
+    if not isinstance(element.tag, str):
+        return None
+    return etree.QName(element).localname
 
 
-def parse_page_xml(page: ParsedPage) -> XmlPage:
-    from bs4 import BeautifulSoup
-    xml = page.start_tag + page.end_tag
-    soup = BeautifulSoup(xml, "lxml")
-    title = soup.find('title').text
-    page_id = int(soup.find('id').text)
-    revisions = [parse_page_revision(r) for r in page.revisions]
-    return XmlPage(title, page_id, revisions)
+def children(element: etree._Element) -> dict[str, etree._Element]:
+    """
+    First child with each tag.
+    """
+    result = {}
+    for child in element:
+        name = local_name(child)
+        if name is not None and name not in result:
+            result[name] = child
+    return result
 
 
-def add_page(original_page: ParsedPage) -> None:
-    conn = get_db()
-    cursor = conn.cursor()
-    page = parse_page_xml(original_page)
+def parse_revision(element: etree._Element) -> XmlRevision:
+    fields = children(element)
+    contributor = "unknown"
+    if "contributor" in fields:
+        # Registered users have a username, anonymous ones an ip; both are missing if the contributor was deleted
+        contributor_fields = children(fields["contributor"])
+        for key in ("username", "ip"):
+            if key in contributor_fields and contributor_fields[key].text is not None:
+                contributor = contributor_fields[key].text
+                break
+    text = fields["text"].text if "text" in fields else None
+    return XmlRevision(int(fields["id"].text), text or "", contributor, fields["timestamp"].text)
+
+
+def parse_page(element: etree._Element) -> XmlPage:
+    fields = children(element)
+    revisions = [parse_revision(child) for child in element if local_name(child) == "revision"]
+    return XmlPage(fields["title"].text, int(fields["id"].text), revisions)
+
+
+def iter_pages(source: BinaryIO) -> Iterator[XmlPage]:
+    """
+    Pages of an export in a single streaming pass. Every page is cleared once it is parsed,
+    together with the pages before it, so only one page is in memory at a time.
+    """
+    # huge_tree lifts libxml2's limits on the size of a single text node, which long revisions exceed
+    for _, element in etree.iterparse(source, events=("end",), tag="{*}page", huge_tree=True):
+        yield parse_page(element)
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def insert_page(cursor: sqlite3.Cursor, page: XmlPage, search: bool = False) -> None:
+    """
+    Add a page, or add the new revisions of a page loaded before. With search, the page's entry in the
+    search index is refreshed whenever its title or latest revision changes.
+    """
+    previous = cursor.execute("SELECT title, latest_revision FROM pages WHERE page_id = ?",
+                              (page.page_id,)).fetchone()
+    latest_revision = page.revisions[-1].revision_id if page.revisions else None
+    # Revision ids only grow, so a page loaded again from an older dump keeps its latest revision
     cursor.execute("""
-    INSERT INTO pages (title, page_id, latest_revision) VALUES (?, ?, ?) 
-    """, (page.title, page.page_id, page.revisions[-1].revision_id))
+    INSERT INTO pages (title, page_id, latest_revision) VALUES (?, ?, ?)
+    ON CONFLICT (page_id) DO UPDATE SET
+        title = excluded.title,
+        latest_revision = CASE
+            WHEN latest_revision IS NULL OR excluded.latest_revision > latest_revision THEN excluded.latest_revision
+            ELSE latest_revision
+        END
+    """, (page.title, page.page_id, latest_revision))
     args = []
     for r in page.revisions:
-        args.append((r.revision_id, page.page_id, r.text, r.contributor, r.timestamp))
+        args.append((r.revision_id, page.page_id, store_text(cursor, r.text), r.contributor, r.timestamp))
     cursor.executemany("""
-    INSERT INTO revisions (revision_id, page_id, text, contributor, timestamp) VALUES (?, ?, ?, ?, ?)
+    INSERT OR IGNORE INTO revisions (revision_id, page_id, text_sha1, contributor, timestamp) VALUES (?, ?, ?, ?, ?)
     """, args)
+    if search and (previous is None or previous[0] != page.title or latest_revision is not None
+                   and (previous[1] is None or latest_revision > previous[1])):
+        index_page(cursor, page.page_id)
+
+
+def _parse_range(file: Path, root_start: bytes, root_end: bytes, start: int, end: int) -> list[XmlPage]:
+    with open(file, "rb") as f:
+        f.seek(start)
+        # A run of whole pages is a valid export again once it is wrapped in the root element,
+        # whose start tag declares the namespaces
+        return list(iter_pages(io.BytesIO(root_start + f.read(end - start) + root_end)))
+
+
+def split_pages(data: mmap.mmap, task_size: int = PARSE_TASK_SIZE) -> list[tuple[int, int]]:
+    """
+    Byte ranges of roughly task_size that each hold a run of whole pages, together covering every page.
+    """
+    first = PAGE_START_PATTERN.search(data)
+    if first is None:
+        return []
+    # Up to the end tag of the root element
+    end = data.rfind(b"</", first.start(), max(data.rfind(b"mediawiki"), first.start()))
+    if end == -1:
+        end = len(data)
+    ranges = []
+    start = first.start()
+    while start < end:
+        match = PAGE_START_PATTERN.search(data, start + task_size, end)
+        boundary = match.start() if match is not None else end
+        ranges.append((start, boundary))
+        start = boundary
+    return ranges
+
+
+def iter_pages_parallel(file: Path, workers: int) -> Iterator[XmlPage]:
+    """
+    Pages of an uncompressed dump, in order, parsed by a pool of processes.
+    """
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        root = ROOT_START_PATTERN.search(data)
+        if root is None:
+            raise ValueError(f"{file.name} has no <mediawiki> element")
+        root_start = root.group(0)
+        prefix = root.group(1) + b":" if root.group(1) is not None else b""
+        root_end = b"</" + prefix + b"mediawiki>"
+        ranges = split_pages(data)
+    tasks = ((file, root_start, root_end, start, end) for start, end in ranges)
+    for pages in ordered_map(_parse_range, tasks, workers):
+        yield from pages
+
+
+def dump_pages(file: Path, workers: int = 1) -> Iterator[XmlPage]:
+    """
+    Pages of a dump. Uncompressed dumps are parsed on several processes if workers is more than one;
+    compressed dumps cannot be split without decompressing them, so they are parsed in this process.
+    """
+    if workers > 1 and not is_compressed(file):
+        yield from iter_pages_parallel(file, workers)
+        return
+    with open_dump_binary(file) as f:
+        yield from iter_pages(f)
+
+
+def add_page(page: XmlPage) -> None:
+    conn = get_db()
+    insert_page(conn.cursor(), page, search_enabled(conn))
     conn.commit()
 
 
-def main():
+def search_enabled(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'page_search'").fetchone() is not None
+
+
+def enable_search(conn: sqlite3.Connection) -> None:
+    """
+    Create the full-text index over the title and latest revision of every page, filled with the pages
+    already loaded. From then on, loading keeps it up to date.
+    """
+    if search_enabled(conn):
+        return
+    try:
+        conn.execute("CREATE VIRTUAL TABLE page_search USING fts5(title, text)")
+    except sqlite3.OperationalError as e:
+        logger.error(f"Cannot create the search index; this sqlite may lack FTS5: {e}")
+        raise
+    start = time.perf_counter()
+    # The rowid of an entry is the page id
+    conn.execute("""
+    INSERT INTO page_search (rowid, title, text)
+    SELECT pages.page_id, title, decode_text(compression, data) FROM pages
+    JOIN revisions ON revisions.revision_id = pages.latest_revision
+    JOIN texts ON texts.sha1 = revisions.text_sha1
+    """)
+    conn.commit()
+    logger.info(f"Built the search index in {time.perf_counter() - start:.1f}s.")
+
+
+def index_page(cursor: sqlite3.Cursor, page_id: int) -> None:
+    cursor.execute("DELETE FROM page_search WHERE rowid = ?", (page_id,))
+    cursor.execute("""
+    INSERT INTO page_search (rowid, title, text)
+    SELECT pages.page_id, title, decode_text(compression, data) FROM pages
+    JOIN revisions ON revisions.revision_id = pages.latest_revision
+    JOIN texts ON texts.sha1 = revisions.text_sha1
+    WHERE pages.page_id = ?
+    """, (page_id,))
+
+
+@dataclass
+class SearchHit:
+    page_id: int
+    title: str
+    snippet: str
+
+
+def search(query: str, limit: int = 20) -> list[SearchHit]:
+    """
+    Pages whose title or latest revision match an FTS5 query, e.g. '"{{Infobox"' or 'cleanup NOT stub',
+    best matches first.
+    """
+    conn = get_db()
+    rows = conn.execute("""
+    SELECT rowid, title, snippet(page_search, 1, '[', ']', '...', 16) FROM page_search
+    WHERE page_search MATCH ? ORDER BY rank LIMIT ?
+    """, (query, limit)).fetchall()
+    return [SearchHit(*row) for row in rows]
+
+
+@dataclass
+class LoadProgress:
+    start: float = field(default_factory=time.perf_counter)
+    pages: int = 0
+    revisions: int = 0
+    text_size: int = 0
+    last_report: float = field(default_factory=time.perf_counter)
+
+    def add(self, page: XmlPage) -> None:
+        self.pages += 1
+        self.revisions += len(page.revisions)
+        self.text_size += sum(len(r.text) for r in page.revisions)
+        if time.perf_counter() - self.last_report >= PROGRESS_INTERVAL:
+            self.log()
+
+    def log(self) -> None:
+        self.last_report = time.perf_counter()
+        seconds = max(self.last_report - self.start, 1e-9)
+        logger.info(f"Loaded {self.pages} pages and {self.revisions} revisions in {seconds:.0f}s: "
+                    f"{self.pages / seconds:.0f} pages/s, {self.revisions / seconds:.0f} revisions/s, "
+                    f"{self.text_size / 1e6 / seconds:.1f}MB/s of text.")
+
+
+@contextmanager
+def bulk_load_settings(conn: sqlite3.Connection) -> Iterator[None]:
+    """
+    Trade durability for speed while loading: no fsync and an in-memory journal. A crash during the
+    load can corrupt the database, which is acceptable since it can be loaded again from the dump.
+    """
+    conn.commit()
+    previous = {pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in BULK_PRAGMAS}
+    for pragma, value in BULK_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    try:
+        yield
+    finally:
+        conn.commit()
+        for pragma, value in previous.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def load_dump(file: Path, bulk: bool = False, batch_size: int = BULK_BATCH_SIZE, search: bool = False,
+              workers: int = 1) -> int:
+    """
+    Load every page of a dump into the database, committing after every page.
+    In bulk mode, pages are committed batch_size at a time with relaxed durability settings,
+    and the secondary indexes are only built after the load.
+    With search, the full-text index is created if needed; once it exists, every load maintains it.
+    With several workers, pages are parsed in a process pool and inserted by this process alone.
+    """
     init_db()
-    file_name = Path(sys.argv[1])
-    assert file_name.exists()
-    with open(file_name, "r") as f:
-        lines = f.readlines()
-    dump_file = parse_lines(lines)
-    for page in dump_file.pages:
-        add_page(page)
+    if search:
+        enable_search(get_db())
+    progress = LoadProgress()
+    if not bulk:
+        for page in dump_pages(file, workers):
+            add_page(page)
+            progress.add(page)
+        progress.log()
+        return progress.pages
+
+    conn = get_db()
+    search = search_enabled(conn)
+    drop_indexes(conn)
+    try:
+        with bulk_load_settings(conn):
+            cursor = conn.cursor()
+            for page in dump_pages(file, workers):
+                insert_page(cursor, page, search)
+                progress.add(page)
+                if progress.pages % batch_size == 0:
+                    conn.commit()
+        progress.log()
+    finally:
+        start = time.perf_counter()
+        create_indexes(conn)
+        logger.info(f"Built the indexes in {time.perf_counter() - start:.1f}s.")
+    if search:
+        # Merge the many small segments written during the load
+        conn.execute("INSERT INTO page_search (page_search) VALUES ('optimize')")
+    conn.execute("ANALYZE")
+    conn.commit()
+    return progress.pages
+
+
+def main():
+    parser = ArgumentParser(description="Load xml dumps into databases/xml.sqlite and search them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load_parser = subparsers.add_parser("load", help="Load an xml dump. Pages loaded before get the new revisions.")
+    load_parser.add_argument("file", type=str, help="Xml dump, optionally compressed (.gz, .bz2 or .7z)")
+    load_parser.add_argument("--bulk", action="store_true",
+                             help="Commit many pages at a time, skip fsync and build the indexes after loading. "
+                                  "Much faster, but an interrupted load can leave a corrupt database.")
+    load_parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE,
+                             help="Pages per transaction with --bulk")
+    load_parser.add_argument("--workers", type=int,
+                             help="Processes that parse an uncompressed dump (default: number of cores)")
+    load_parser.add_argument("--search-index", action="store_true",
+                             help="Create a full-text index over the latest revision of every page. "
+                                  "Later loads keep it up to date.")
+
+    search_parser = subparsers.add_parser("search", help="Search the titles and latest revisions of the pages.")
+    search_parser.add_argument("query", type=str, help='FTS5 query, e.g. \'"{{Infobox"\'')
+    search_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "load":
+        file = Path(args.file)
+        assert file.exists()
+        load_dump(file, args.bulk, args.batch_size, args.search_index, args.workers or os.cpu_count() or 1)
+        return
+    if not search_enabled(get_db()):
+        logger.error("There is no search index. Load a dump with --search-index first.")
+        exit(1)
+    for hit in search(args.query, args.limit):
+        print(f"{hit.title} ({hit.page_id}): {hit.snippet}")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
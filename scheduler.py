@@ -0,0 +1,240 @@
+"""
+Resident scheduler that replaces the one-shot systemd timers.
+
+Jobs run one after another in this process, so pywikibot, the Wikibase login, the HTTP
+session and the wiki catalog are only set up once and stay warm between runs.
+Jobs that share a lock name never overlap, not even with a copy of the job started by hand
+in another process. A job can depend on another one instead of having an interval of its own; it then
+runs right after every successful run of that job. The outcome of every job is written to a status file.
+"""
+import fcntl
+import json
+import random
+import signal
+import sys
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from utils.general_utils import cache_dir, dump_json, get_logger
+
+logger = get_logger("scheduler")
+
+status_file = cache_dir / "scheduler_status.json"
+lock_dir = cache_dir / "locks"
+
+# How long to wait before trying again when another process holds a job's lock
+LOCK_RETRY_DELAY = timedelta(minutes=10)
+
+
+@dataclass
+class Job:
+    name: str
+    run: Callable[[], None]
+    interval: timedelta | None = None
+    # Each run is delayed by a random amount up to this much so jobs do not fire in lockstep
+    jitter: timedelta = timedelta(minutes=10)
+    lock: str | None = None
+    # Name of the job after whose successful runs this one runs, instead of on an interval
+    after: str | None = None
+
+
+@dataclass
+class JobStatus:
+    name: str
+    last_start: str | None = None
+    last_duration: float | None = None
+    last_result: str | None = None
+    next_run: str | None = None
+    runs: int = 0
+    failures: int = 0
+
+
+def count_wikis():
+    import wiki_count_tracking
+    wiki_count_tracking.main()
+
+
+def scan_statistics():
+    from wiki_scanners.analyses import force_update_all_statistics
+    force_update_all_statistics()
+
+
+def update_communities_db():
+    from communities.wiki_db import db_fetch, update_local_db
+    update_local_db()
+    # db_fetch caches the table for the lifetime of the process
+    db_fetch.cache_clear()
+
+
+def update_wikibase_pages():
+    from communities.update_wiki_stats import update_all_wikibase_pages
+    update_all_wikibase_pages()
+
+
+def update_list_pages():
+    from communities.list_wikis import update_wiki_list_pages
+    update_wiki_list_pages()
+
+
+def update_ranking():
+    from communities.wiki_ranking import rank_wikis
+    rank_wikis()
+
+
+JOBS: list[Job] = [
+    Job("wiki_count_tracking", count_wikis, interval=timedelta(days=1)),
+    Job("scan_statistics", scan_statistics, interval=timedelta(days=1), jitter=timedelta(hours=1),
+        lock="wiki_scanner"),
+    Job("update_local_db", update_communities_db, interval=timedelta(days=1), lock="communities"),
+    Job("update_wikibase_pages", update_wikibase_pages, interval=timedelta(days=7), jitter=timedelta(hours=2),
+        lock="communities"),
+    # Both publish the statistics of the scan, so they wait for it and keep it from starting while they read
+    Job("update_wiki_list_pages", update_list_pages, after="scan_statistics", lock="wiki_scanner"),
+    Job("rank_wikis", update_ranking, after="scan_statistics", lock="wiki_scanner"),
+]
+
+
+class JobLock:
+    """
+    Exclusive, non-blocking file lock shared with every other process using the same lock name.
+    """
+
+    def __init__(self, name: str):
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        self.path = lock_dir / f"{name}.lock"
+        self.file = None
+
+    def acquire(self) -> bool:
+        self.file = open(self.path, "w")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+
+    def release(self) -> None:
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+def load_statuses(jobs: list[Job], file: Path = status_file) -> dict[str, JobStatus]:
+    saved: dict[str, dict] = {}
+    if file.exists():
+        with open(file, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    return dict((job.name, JobStatus(**saved.get(job.name, {"name": job.name}))) for job in jobs)
+
+
+def save_statuses(statuses: dict[str, JobStatus], file: Path = status_file) -> None:
+    tmp_file = file.with_suffix(".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write(dump_json(statuses))
+    tmp_file.replace(file)
+
+
+def schedule_next(job: Job, status: JobStatus, after: datetime) -> None:
+    jitter = timedelta(seconds=random.uniform(0, job.jitter.total_seconds()))
+    status.next_run = (after + jitter).isoformat(timespec="seconds")
+
+
+def run_job(job: Job, status: JobStatus) -> None:
+    lock = JobLock(job.lock or job.name)
+    if not lock.acquire():
+        status.last_result = "skipped: locked"
+        if job.after is not None:
+            logger.warning(f"{job.name} is locked by another process. Skipping it until the next run of {job.after}.")
+            return
+        logger.warning(f"{job.name} is locked by another process. Retrying later.")
+        schedule_next(job, status, datetime.now() + LOCK_RETRY_DELAY)
+        return
+    start = datetime.now()
+    started = time.monotonic()
+    status.last_start = start.isoformat(timespec="seconds")
+    logger.info(f"Running {job.name}")
+    try:
+        job.run()
+        status.last_result = "success"
+    except Exception as e:
+        logger.error(f"{job.name} failed: {e}\n{traceback.format_exc()}")
+        status.last_result = f"failed: {e}"
+        status.failures += 1
+    finally:
+        lock.release()
+    status.runs += 1
+    status.last_duration = round(time.monotonic() - started, 3)
+    if job.after is None:
+        schedule_next(job, status, start + job.interval)
+    logger.info(f"{job.name} finished in {status.last_duration}s: {status.last_result}")
+
+
+def run_chain(job: Job, jobs: list[Job], statuses: dict[str, JobStatus], stop: threading.Event) -> None:
+    """
+    Run a job, then the jobs that depend on it if it succeeded.
+    """
+    run_job(job, statuses[job.name])
+    save_statuses(statuses)
+    if statuses[job.name].last_result != "success":
+        return
+    for dependent in jobs:
+        if dependent.after == job.name and not stop.is_set():
+            run_chain(dependent, jobs, statuses, stop)
+
+
+def run_forever(jobs: list[Job], stop: threading.Event) -> None:
+    statuses = load_statuses(jobs)
+    scheduled = [job for job in jobs if job.after is None]
+    now = datetime.now()
+    for job in jobs:
+        status = statuses[job.name]
+        if job.after is not None:
+            status.next_run = None
+        elif status.next_run is None:
+            schedule_next(job, status, now)
+    save_statuses(statuses)
+    while not stop.is_set():
+        now = datetime.now()
+        due = [job for job in scheduled if datetime.fromisoformat(statuses[job.name].next_run) <= now]
+        for job in sorted(due, key=lambda j: statuses[j.name].next_run):
+            if stop.is_set():
+                break
+            run_chain(job, jobs, statuses, stop)
+        next_run = min(datetime.fromisoformat(statuses[job.name].next_run) for job in scheduled)
+        stop.wait(min(max((next_run - datetime.now()).total_seconds(), 0), 60))
+    logger.info("Scheduler stopped.")
+
+
+def main():
+    parser = ArgumentParser(description="Run the periodic Miraheze jobs in a single long-running process.")
+    parser.add_argument("--run-once", type=str, choices=[job.name for job in JOBS],
+                        help="Run a single job now and exit.")
+    args = parser.parse_args()
+    if args.run_once is not None:
+        job = next(j for j in JOBS if j.name == args.run_once)
+        statuses = load_statuses(JOBS)
+        run_job(job, statuses[job.name])
+        save_statuses(statuses)
+        if statuses[job.name].last_result != "success":
+            sys.exit(1)
+        return
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    # Warm up the wiki catalog so the first job does not pay for it
+    from utils.wiki_catalog import get_wiki_catalog
+    get_wiki_catalog()
+    run_forever(JOBS, stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,17 @@ import sys
 from dataclasses import dataclass
 from functools import cache
 from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING
 
 import requests
-from pywikibot import Site, Page
-from pywikibot.data.api import Request
 from requests import Session
 
+# pywikibot takes a noticeable fraction of a second to import, so it is only
+# imported by the functions that talk to a wiki through it.
+if TYPE_CHECKING:
+    from pywikibot import Site, Page
+
 user_agent = 'MediaWiki bot by User:PetraMagna'
 headers = {'User-Agent': user_agent, }
 anonymous_headers = {'User-Agent': 'MediaWiki bot', }
@@ -20,7 +25,8 @@ cache_dir = Path('cache')
 cache_dir.mkdir(parents=True, exist_ok=True)
 
 
-def meta():
+def meta() -> 'Site':
+    from pywikibot import Site
     return Site(code="meta")
 
 
@@ -32,7 +38,7 @@ class WikiState(enum.Enum):
     DELETED = "deleted"
 
 
-@dataclass
+@dataclass(slots=True)
 class MirahezeWiki:
     db_name: str
     site_name: str
@@ -58,8 +64,8 @@ class MirahezeWiki:
         return f"{self.site_name} ({self.url})"
 
 
-@cache
 def fetch_all_mh_wikis_uncached(state: str = "public") -> list[MirahezeWiki]:
+    from pywikibot.data.api import Request
     results: list[MirahezeWiki] = []
     offset = 0
     while True:
@@ -97,15 +103,25 @@ def fetch_all_mh_wikis_uncached(state: str = "public") -> list[MirahezeWiki]:
     return results
 
 
+@cache
+def http_session() -> Session:
+    """
+    Process-wide HTTP session so that repeated api calls reuse their connections.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    return session
+
+
 def get_num_of_recent_changes(wiki: MirahezeWiki) -> int:
-    result = requests.get(wiki.api_url, {
+    result = http_session().get(wiki.api_url, params={
         'action': 'query',
         'list': 'recentchanges',
         'rcnamespace': '*',
         'rcprop': 'user',
         'rclimit': 100,
         'format': 'json'
-    }, headers=headers).json()['query']['recentchanges']
+    }).json()['query']['recentchanges']
     return len(result)
 
 
@@ -181,7 +197,8 @@ def login(url: str, username: str, password: str) -> SessionInfo:
     return SessionInfo(url, session)
 
 
-def site() -> Site:
+def site() -> 'Site':
+    from pywikibot import Site
     return Site()
 
 
@@ -197,7 +214,8 @@ def dump_json(o):
     return json.dumps(o, indent=4, cls=EnhancedJSONEncoder)
 
 
-def save_json_page(page: Page | str, obj, summary: str = "update json page"):
+def save_json_page(page: 'Page | str', obj, summary: str = "update json page"):
+    from pywikibot import Page
     if isinstance(page, str):
         page = Page(site(), page)
 
@@ -212,15 +230,23 @@ def save_json_page(page: Page | str, obj, summary: str = "update json page"):
         page.save(summary=summary)
 
 
+_throttle_lock = Lock()
+
+
 def throttle(seconds: float):
+    """
+    Wait until at least `seconds` have passed since the previous call. Safe to call from several threads;
+    they are let through one at a time.
+    """
     import time
     def get_current_time_milli():
         return round(time.time() * 1000)
 
-    prev: float | None = getattr(throttle, "prev", None)
-    if prev is not None:
-        wakeup_time = prev + seconds * 1000
-        sleep_seconds = (wakeup_time - get_current_time_milli()) / 1000
-        if sleep_seconds > 0:
-            time.sleep(sleep_seconds)
-    setattr(throttle, "prev", get_current_time_milli())
\ No newline at end of file
+    with _throttle_lock:
+        prev: float | None = getattr(throttle, "prev", None)
+        if prev is not None:
+            wakeup_time = prev + seconds * 1000
+            sleep_seconds = (wakeup_time - get_current_time_milli()) / 1000
+            if sleep_seconds > 0:
+                time.sleep(sleep_seconds)
+        setattr(throttle, "prev", get_current_time_milli())
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Check that the entry point modules stay cheap to import.
+
+Every module is imported in a fresh interpreter with -X importtime. The check fails when a
+cold import exceeds its time budget or pulls in a library that must stay lazy (pywikibot
+and wikibaseintegrator are only imported by the functions that need them).
+
+Usage: uv run -m utils.import_budget [--scale 2.0] [module ...]
+"""
+import subprocess
+import sys
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+DEFAULT_BUDGET_MS = 400
+
+LAZY_MODULES = {"pywikibot", "wikibaseintegrator"}
+
+MODULE_BUDGETS_MS: dict[str, int] = {
+    "utils.general_utils": 250,
+    "utils.wiki_catalog": 250,
+    "wiki_scanners.site_statistics": 250,
+    "wiki_scanners.extension_statistics": 250,
+    "wiki_scanners.analyses": 400,
+    "wiki_scanners.recent_changes_listener": 300,
+    "communities.wbi_helper": 250,
+    "communities.wiki_db": 250,
+    "communities.list_wikis": 400,
+    "communities.wiki_ranking": 400,
+    "communities.update_everything": 600,
+    "importing.import_sharder": 250,
+    "importing.xml_to_db": 400,
+}
+
+# Modules that need one of LAZY_MODULES for almost everything they do
+EAGER_IMPORTS_ALLOWED: dict[str, set[str]] = {
+    "communities.update_wiki_stats": {"wikibaseintegrator"},
+    "communities.update_everything": {"wikibaseintegrator"},
+}
+
+
+@dataclass
+class ImportMeasurement:
+    module: str
+    cumulative_ms: float
+    imported: set[str]
+    error: str | None = None
+
+
+def measure_import(module: str) -> ImportMeasurement:
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True)
+    cumulative_ms = 0.0
+    imported: set[str] = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative_ms = int(parts[1]) / 1000
+    error = None
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "import failed"
+    return ImportMeasurement(module, cumulative_ms, imported, error)
+
+
+def check_module(module: str, scale: float = 1.0) -> list[str]:
+    measurement = measure_import(module)
+    if measurement.error is not None:
+        return [f"{module}: {measurement.error}"]
+    problems = []
+    budget = MODULE_BUDGETS_MS.get(module, DEFAULT_BUDGET_MS) * scale
+    if measurement.cumulative_ms > budget:
+        problems.append(f"{module}: import took {measurement.cumulative_ms:.0f}ms, budget is {budget:.0f}ms")
+    eager = (measurement.imported & LAZY_MODULES) - EAGER_IMPORTS_ALLOWED.get(module, set())
+    for lazy_module in sorted(eager):
+        problems.append(f"{module}: imports {lazy_module} at import time")
+    return problems
+
+
+def main():
+    parser = ArgumentParser(description="Fail when a module's cold import exceeds its budget.")
+    parser.add_argument("modules", nargs="*", help="Modules to check. Defaults to all budgeted modules.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply every budget, e.g. on a slow machine.")
+    args = parser.parse_args()
+    modules = args.modules or list(MODULE_BUDGETS_MS.keys())
+    problems = []
+    for module in modules:
+        problems.extend(check_module(module, args.scale))
+    for problem in problems:
+        print(problem)
+    if len(problems) > 0:
+        sys.exit(1)
+    print(f"All {len(modules)} modules are within their import budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterator, Mapping
+from datetime import timedelta
+
+from utils.general_utils import MirahezeWiki
+from utils.wiki_scanner import fetch_all_mh_wikis, get_all_wikis_version, is_wiki_list_expired, \
+    DEFAULT_CACHE_EXPIRY
+
+
+def url_to_host(url: str) -> str:
+    return url.split("://", 1)[-1].rstrip("/")
+
+
+class WikiCatalog(Mapping[str, MirahezeWiki]):
+    """
+    In-memory view of the all_wikis table, indexed by db name, host, state, language, category
+    and creation date. Behaves like a read-only dict from db name to wiki.
+    """
+    __slots__ = ("version", "_by_db_name", "_by_host", "_by_state", "_by_language", "_by_category",
+                 "_creation_dates", "_by_creation_date")
+
+    def __init__(self, wikis: list[MirahezeWiki], version: int | None = None):
+        self.version = version
+        self._by_db_name: dict[str, MirahezeWiki] = {}
+        self._by_host: dict[str, MirahezeWiki] = {}
+        self._by_state: dict[str, list[MirahezeWiki]] = defaultdict(list)
+        self._by_language: dict[str, list[MirahezeWiki]] = defaultdict(list)
+        self._by_category: dict[str, list[MirahezeWiki]] = defaultdict(list)
+        for wiki in wikis:
+            self._by_db_name[wiki.db_name] = wiki
+            self._by_host[url_to_host(wiki.url)] = wiki
+            # Some wikis have more than one state (e.g. "inactive|closed")
+            for state in wiki.state.split("|"):
+                self._by_state[state].append(wiki)
+            self._by_language[wiki.language].append(wiki)
+            self._by_category[wiki.category].append(wiki)
+        dated = sorted((w for w in wikis if w.creation_date), key=lambda w: w.creation_date)
+        self._creation_dates: list[str] = [w.creation_date for w in dated]
+        self._by_creation_date: list[MirahezeWiki] = dated
+
+    def __getitem__(self, db_name: str) -> MirahezeWiki:
+        return self._by_db_name[db_name]
+
+    def __contains__(self, db_name: object) -> bool:
+        return db_name in self._by_db_name
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_db_name)
+
+    def __len__(self) -> int:
+        return len(self._by_db_name)
+
+    def by_url(self, url: str) -> MirahezeWiki | None:
+        """
+        Look up a wiki by its url or host name (e.g. "https://meta.miraheze.org" or "meta.miraheze.org").
+        """
+        return self._by_host.get(url_to_host(url))
+
+    def by_state(self, state: str) -> list[MirahezeWiki]:
+        return self._by_state.get(state, [])
+
+    def by_language(self, language: str) -> list[MirahezeWiki]:
+        return self._by_language.get(language, [])
+
+    def by_category(self, category: str) -> list[MirahezeWiki]:
+        return self._by_category.get(category, [])
+
+    def created_between(self, start: str | None = None, end: str | None = None) -> list[MirahezeWiki]:
+        """
+        Wikis created in the half-open range [start, end), ordered by creation date.
+        Both bounds are ISO 8601 strings (e.g. "2024-01-01") and compare like creation_date does.
+        """
+        lo = 0 if start is None else bisect_left(self._creation_dates, start)
+        hi = len(self._creation_dates) if end is None else bisect_left(self._creation_dates, end)
+        return self._by_creation_date[lo:hi]
+
+
+# Seconds between checks whether another process refreshed the all_wikis table.
+# Refreshes in this process invalidate the catalog right away.
+VERSION_CHECK_INTERVAL = 60
+
+_catalog: WikiCatalog | None = None
+_checked_at: float | None = None
+
+
+def get_wiki_catalog(cache_expiry: timedelta = DEFAULT_CACHE_EXPIRY) -> WikiCatalog:
+    """
+    Process-wide wiki catalog. It is loaded once and rebuilt only when the all_wikis table
+    has been refreshed (by this or another process) or has expired. The table is consulted at most
+    once every VERSION_CHECK_INTERVAL seconds, so calling this per row or per event is a dict hit.
+    """
+    global _catalog, _checked_at
+    now = time.monotonic()
+    if _catalog is not None and _checked_at is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return _catalog
+    version = get_all_wikis_version()
+    if _catalog is None or _catalog.version != version or is_wiki_list_expired(version, cache_expiry):
+        wikis = fetch_all_mh_wikis(cache_expiry=cache_expiry)
+        _catalog = WikiCatalog(wikis, get_all_wikis_version())
+    _checked_at = now
+    return _catalog
+
+
+def invalidate_wiki_catalog() -> None:
+    global _catalog, _checked_at
+    _catalog = None
+    _checked_at = None
@@ -1,7 +1,7 @@
 from datetime import timedelta, datetime
 from pathlib import Path
 from sqlite3 import Connection
-from typing import TypeVar, Callable
+from typing import TypeVar, Callable, Iterable
 
 import jsonpickle
 
@@ -43,23 +43,28 @@ def deserialize_miraheze_wikis(rows: list[tuple[str, str, str, str, str, str, st
     return [MirahezeWiki.from_sql_row(row) for row in rows]
 
 
-def fetch_all_mh_wikis(cache_expiry: timedelta = DEFAULT_CACHE_EXPIRY) -> list[MirahezeWiki]:
+def get_all_wikis_version() -> int | None:
+    """
+    Timestamp of the last refresh of the all_wikis table, or None if it has never been populated.
+    Changes whenever fetch_all_mh_wikis writes a new list of wikis.
+    """
     create_tables()
-    conn = get_conn(db_name)
-    cursor = conn.cursor()
-    cursor.execute(f"""
+    cursor = get_conn(db_name).execute(f"""
     SELECT expiration FROM {CACHE_EXPIRY_TABLE}
     WHERE table_name = ?
     """, ("all_wikis",))
-    rows = cursor.fetchall()
-    fetch_new_list = False
-    if len(rows) == 0:
-        fetch_new_list = True
-    else:
-        expiry_date = rows[0][0]
-        if datetime.fromtimestamp(expiry_date) + cache_expiry < datetime.now():
-            fetch_new_list = True
-    if fetch_new_list:
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def is_wiki_list_expired(version: int | None, cache_expiry: timedelta = DEFAULT_CACHE_EXPIRY) -> bool:
+    return version is None or datetime.fromtimestamp(version) + cache_expiry < datetime.now()
+
+
+def fetch_all_mh_wikis(cache_expiry: timedelta = DEFAULT_CACHE_EXPIRY) -> list[MirahezeWiki]:
+    conn = get_conn(db_name)
+    cursor = conn.cursor()
+    if is_wiki_list_expired(get_all_wikis_version(), cache_expiry):
         print("Fetching list of all wikis again due to cache expiry.")
         wikis = fetch_all_mh_wikis_uncached()
         data = [wiki.to_sql_values() for wiki in wikis]
@@ -69,6 +74,8 @@ def fetch_all_mh_wikis(cache_expiry: timedelta = DEFAULT_CACHE_EXPIRY) -> list[M
         VALUES (?, ?)
         """, ('all_wikis', int(datetime.now().timestamp())))
         conn.commit()
+        from utils.wiki_catalog import invalidate_wiki_catalog
+        invalidate_wiki_catalog()
     cursor.execute(f"""
     SELECT * FROM all_wikis
     """)
@@ -100,7 +107,13 @@ def scan_wikis(mapper: Callable[[list[MirahezeWiki]], dict[str, T | None]],
                table_name: str,
                reset: bool = False,
                batch_size: int = 1,
-               read_only: bool = False) -> dict[str, T]:
+               read_only: bool = False,
+               db_names: Iterable[str] | None = None) -> dict[str, T]:
+    """
+    Run mapper over wikis and store its results in table_name, then return the whole table.
+    By default only wikis missing from the table are scanned; reset rescans every wiki and
+    db_names rescans exactly the given wikis.
+    """
     conn = get_conn(db_name)
     cursor = conn.cursor()
     cursor.execute(f"""
@@ -111,7 +124,15 @@ def scan_wikis(mapper: Callable[[list[MirahezeWiki]], dict[str, T | None]],
     )""")
     conn.commit()
     if not read_only:
-        if reset:
+        if db_names is not None:
+            db_names = list(db_names)
+            placeholders = ", ".join("?" for _ in db_names)
+            cursor.execute(f"""
+            SELECT * FROM all_wikis
+            WHERE db_name IN ({placeholders})
+            """, db_names)
+            wikis = deserialize_miraheze_wikis(cursor.fetchall())
+        elif reset:
             wikis = fetch_all_mh_wikis()
         else:
             cursor.execute(f"""
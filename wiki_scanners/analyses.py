@@ -2,23 +2,21 @@ from collections import defaultdict
 from datetime import timedelta
 
 from utils.general_utils import MirahezeWiki, save_json_page
+from utils.wiki_catalog import get_wiki_catalog
 from utils.wiki_scanner import fetch_all_mh_wikis
 from wiki_scanners.extension_statistics import get_wiki_extension_statistics, sort_dict, WikiExtensionStatistics
-from wiki_scanners.site_statistics import get_wiki_site_statistics, WikiSiteStatistics
-
-wikis: dict[str, MirahezeWiki] = dict((w.db_name, w) for w in fetch_all_mh_wikis())
+from wiki_scanners.site_statistics import get_wiki_site_statistics
+from wiki_scanners.statistics_snapshot import load_statistics_snapshot
 
 
 def get_wiki_active_editors() -> dict[str, int]:
     result: dict[str, int] = defaultdict(int)
-    for k, v in get_wiki_site_statistics(read_only=True).items():
-        v: WikiSiteStatistics
-        if v is not None:
-            result[k] = v.active_users
+    result.update(load_statistics_snapshot().to_dict('active_users'))
     return result
 
 
 def get_wikis_with_most_and_least_extensions():
+    wikis = get_wiki_catalog()
     s1 = get_wiki_extension_statistics(read_only=True)
     result: list[tuple[MirahezeWiki, list[str]]] = []
     for k, v in s1.items():
@@ -1,10 +1,9 @@
 from collections import defaultdict
+from collections.abc import Iterable
 from dataclasses import dataclass
 from typing import TypeVar, Any
 
-import requests
-
-from utils.general_utils import MirahezeWiki, headers, meta, save_json_page
+from utils.general_utils import MirahezeWiki, http_session, save_json_page
 from utils.wiki_scanner import scan_wikis
 
 
@@ -16,14 +15,14 @@ class WikiExtensionStatistics:
 
 def fetch_wiki_extension_statistics(wikis: list[MirahezeWiki]) -> dict[str, WikiExtensionStatistics]:
     db_names = "|".join(w.db_name for w in wikis)
-    response = requests.get("https://meta.miraheze.org/w/api.php", params={
+    response = http_session().get("https://meta.miraheze.org/w/api.php", params={
         'action': 'query',
         'list': 'wikiconfig',
         'wcfwikis': db_names,
         'wcfprop': 'settings|extensions',
         'format': 'json',
         'formatversion': 2,
-    }, headers=headers)
+    })
     response = response.json()['query']['wikiconfig']
     result: dict[str, WikiExtensionStatistics] = {}
     for row in response:
@@ -50,12 +49,15 @@ def sort_dict(d: dict[K, V]) -> None:
     d.update(result)
 
 
-def get_wiki_extension_statistics(reset: bool = False, read_only: bool = False) -> dict[str, WikiExtensionStatistics]:
+def get_wiki_extension_statistics(reset: bool = False,
+                                  read_only: bool = False,
+                                  db_names: Iterable[str] | None = None) -> dict[str, WikiExtensionStatistics]:
     res = scan_wikis(fetch_wiki_extension_statistics,
                      "wiki_extensions",
                      reset=reset,
                      batch_size=50,
-                     read_only=read_only)
+                     read_only=read_only,
+                     db_names=db_names)
     for k, v in res.items():
         if isinstance(v, dict):
             v.pop('py/object', '')
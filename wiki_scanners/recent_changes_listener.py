@@ -0,0 +1,256 @@
+import json
+import time
+from argparse import ArgumentParser
+from collections.abc import Iterable, Iterator, Callable
+from dataclasses import dataclass
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Thread
+from typing import Any
+
+import requests
+
+from utils.general_utils import headers, get_logger
+from utils.wiki_catalog import WikiCatalog, get_wiki_catalog
+from wiki_scanners.extension_statistics import get_wiki_extension_statistics
+from wiki_scanners.site_statistics import get_wiki_site_statistics
+
+logger = get_logger("recent_changes_listener")
+
+# Flush a micro-batch once this many wikis are dirty...
+DEFAULT_BATCH_SIZE = 50
+# ...or once the oldest dirty wiki has waited this long.
+DEFAULT_MAX_DELAY = 300
+# Seconds between checks for an overdue batch while the stream is quiet
+FLUSH_CHECK_INTERVAL = 5
+
+
+@dataclass
+class ServerSentEvent:
+    data: str
+    event: str = "message"
+    id: str | None = None
+
+    def json(self) -> Any:
+        return json.loads(self.data)
+
+
+def parse_sse(lines: Iterable[str]) -> Iterator[ServerSentEvent]:
+    """
+    Turn the lines of a text/event-stream response into events.
+    Comments (lines starting with ":") and unknown fields are ignored.
+    """
+    data: list[str] = []
+    event = "message"
+    event_id = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line == "":
+            if len(data) > 0:
+                yield ServerSentEvent("\n".join(data), event, event_id)
+            data = []
+            event = "message"
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            data.append(value)
+        elif field == "event":
+            event = value
+        elif field == "id":
+            event_id = value
+    if len(data) > 0:
+        yield ServerSentEvent("\n".join(data), event, event_id)
+
+
+def http_event_lines(url: str, retry_delay: float = 5) -> Iterator[str]:
+    """
+    Lines of a remote event stream. Reconnects with Last-Event-ID after network errors
+    so no changes are missed across reconnects.
+    """
+    last_event_id = None
+    while True:
+        request_headers = headers | {"Accept": "text/event-stream"}
+        if last_event_id is not None:
+            request_headers["Last-Event-ID"] = last_event_id
+        try:
+            with requests.get(url, stream=True, headers=request_headers, timeout=(10, 120)) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("id:"):
+                        last_event_id = line[3:].strip()
+                    yield line
+        except requests.RequestException as e:
+            logger.warning(f"Event stream disconnected: {e}. Reconnecting in {retry_delay} seconds.")
+        time.sleep(retry_delay)
+
+
+class LocalEventSource:
+    """
+    Stand-in for a remote event stream. Serves recent change events (dicts) as
+    text/event-stream lines, either from memory or from a file with one json object per line.
+    """
+
+    def __init__(self, events: Iterable[dict[str, Any]]):
+        self.events = events
+
+    @classmethod
+    def from_file(cls, file: Path) -> 'LocalEventSource':
+        with open(file, "r", encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip() != ""]
+        return cls(events)
+
+    def lines(self) -> Iterator[str]:
+        for index, event in enumerate(self.events):
+            yield f"id: {index}"
+            yield "event: message"
+            yield f"data: {json.dumps(event)}"
+            yield ""
+
+
+class DirtyWikis:
+    """
+    Set of wikis that changed since the last flush, released in micro-batches.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, max_delay: float = DEFAULT_MAX_DELAY,
+                 clock: Callable[[], float] = time.monotonic):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.clock = clock
+        self.statistics: set[str] = set()
+        self.extensions: set[str] = set()
+        self.oldest: float | None = None
+
+    def __len__(self) -> int:
+        return len(self.statistics | self.extensions)
+
+    def add(self, db_name: str, extensions_changed: bool = False) -> None:
+        if self.oldest is None:
+            self.oldest = self.clock()
+        self.statistics.add(db_name)
+        if extensions_changed:
+            self.extensions.add(db_name)
+
+    def is_due(self) -> bool:
+        if self.oldest is None:
+            return False
+        return len(self) >= self.batch_size or self.clock() - self.oldest >= self.max_delay
+
+    def drain(self) -> tuple[list[str], list[str]]:
+        result = sorted(self.statistics), sorted(self.extensions)
+        self.statistics.clear()
+        self.extensions.clear()
+        self.oldest = None
+        return result
+
+
+def event_to_db_name(event: dict[str, Any], catalog: WikiCatalog) -> str | None:
+    db_name = event.get("wiki")
+    if db_name in catalog:
+        return db_name
+    server_name = event.get("server_name") or event.get("meta", {}).get("domain")
+    if server_name is None:
+        return None
+    wiki = catalog.by_url(server_name)
+    return wiki.db_name if wiki is not None else None
+
+
+def changes_extensions(event: dict[str, Any]) -> bool:
+    # Extensions and settings are only changed through ManageWiki, which logs every change.
+    return event.get("type") == "log" and str(event.get("log_type", "")).startswith("managewiki")
+
+
+def rescan(statistics: list[str], extensions: list[str]) -> None:
+    if len(statistics) > 0:
+        logger.info(f"Updating statistics of {len(statistics)} wikis")
+        get_wiki_site_statistics(db_names=statistics)
+    if len(extensions) > 0:
+        logger.info(f"Updating extensions of {len(extensions)} wikis")
+        get_wiki_extension_statistics(db_names=extensions)
+
+
+def listen(lines: Iterable[str],
+           dirty: DirtyWikis | None = None,
+           flush: Callable[[list[str], list[str]], None] = rescan) -> None:
+    """
+    Consume recent change events and rescan the wikis they touch in micro-batches.
+    The stream is read on a separate thread, so a batch that becomes overdue while the stream is quiet
+    or reconnecting is still flushed on time. Flushes run on the calling thread, which owns the database
+    connection. Whatever is still dirty when the stream ends is flushed as a last batch.
+    """
+    if dirty is None:
+        dirty = DirtyWikis()
+    # Events, then None once the stream ends
+    events: Queue[ServerSentEvent | None] = Queue(maxsize=10000)
+    errors: list[BaseException] = []
+
+    def read() -> None:
+        try:
+            for sse in parse_sse(lines):
+                events.put(sse)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            events.put(None)
+
+    def flush_batch() -> WikiCatalog:
+        statistics, extensions = dirty.drain()
+        try:
+            flush(statistics, extensions)
+        except Exception as e:
+            logger.error(f"Failed to rescan {len(statistics)} wikis, retrying them with the next batch: {e!r}")
+            for db_name in statistics:
+                dirty.add(db_name, extensions_changed=db_name in extensions)
+        return get_wiki_catalog()
+
+    reader = Thread(target=read, name="event-reader", daemon=True)
+    reader.start()
+    # Read once per micro-batch instead of once per event
+    catalog = get_wiki_catalog()
+    while True:
+        try:
+            sse = events.get(timeout=min(FLUSH_CHECK_INTERVAL, dirty.max_delay))
+        except Empty:
+            if dirty.is_due():
+                catalog = flush_batch()
+            continue
+        if sse is None:
+            break
+        try:
+            event = sse.json()
+        except json.JSONDecodeError:
+            logger.warning(f"Cannot decode event {sse.id}: {sse.data[:200]}")
+            continue
+        db_name = event_to_db_name(event, catalog)
+        if db_name is not None:
+            dirty.add(db_name, extensions_changed=changes_extensions(event))
+        if dirty.is_due():
+            catalog = flush_batch()
+    if len(dirty) > 0:
+        flush_batch()
+    if errors:
+        raise errors[0]
+
+
+def main():
+    parser = ArgumentParser(description="Keep wiki statistics up to date from a recent changes event stream.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--url", type=str, help="Url of a server-sent events recent changes stream.")
+    source.add_argument("--replay", type=str, help="File with one recent change event (json) per line.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY,
+                        help="Seconds a changed wiki may wait before its batch is flushed.")
+    args = parser.parse_args()
+    if args.url is not None:
+        lines = http_event_lines(args.url)
+    else:
+        lines = LocalEventSource.from_file(Path(args.replay)).lines()
+    listen(lines, DirtyWikis(args.batch_size, args.max_delay))
+
+
+if __name__ == "__main__":
+    main()
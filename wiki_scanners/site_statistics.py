@@ -1,8 +1,7 @@
+from collections.abc import Iterable
 from dataclasses import dataclass
 
-import requests
-
-from utils.general_utils import MirahezeWiki, headers
+from utils.general_utils import MirahezeWiki, http_session
 from utils.wiki_scanner import scan_wikis
 
 
@@ -19,12 +18,12 @@ class WikiSiteStatistics:
 def fetch_wiki_site_statistics(wikis: list[MirahezeWiki]) -> dict[str, WikiSiteStatistics | None]:
     wiki = wikis[0]
     try:
-        response = requests.get(wiki.api_url, params={
+        response = http_session().get(wiki.api_url, params={
             'action': 'query',
             'meta': 'siteinfo',
             'siprop': 'statistics',
             'format': 'json',
-        }, headers=headers)
+        })
         r = response.json()['query']['statistics']
         result = WikiSiteStatistics(
             pages=r['pages'],
@@ -42,12 +41,19 @@ def fetch_wiki_site_statistics(wikis: list[MirahezeWiki]) -> dict[str, WikiSiteS
     }
 
 
-def get_wiki_site_statistics(reset: bool = False, read_only: bool = False) -> dict[str, WikiSiteStatistics | None]:
-    return scan_wikis(fetch_wiki_site_statistics,
-                      "wiki_statistics",
-                      reset=reset,
-                      batch_size=1,
-                      read_only=read_only)
+def get_wiki_site_statistics(reset: bool = False,
+                             read_only: bool = False,
+                             db_names: Iterable[str] | None = None) -> dict[str, WikiSiteStatistics | None]:
+    result = scan_wikis(fetch_wiki_site_statistics,
+                        "wiki_statistics",
+                        reset=reset,
+                        batch_size=1,
+                        read_only=read_only,
+                        db_names=db_names)
+    if not read_only:
+        from wiki_scanners.statistics_snapshot import export_statistics_snapshot
+        export_statistics_snapshot(result)
+    return result
 
 
 def main():
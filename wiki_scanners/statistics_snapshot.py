@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+from utils.db_utils import db_dir
+from utils.general_utils import get_logger
+from wiki_scanners.site_statistics import WikiSiteStatistics, get_wiki_site_statistics
+
+logger = get_logger("statistics_snapshot")
+
+# Names the directory of the current snapshot; every snapshot is written to a new directory next to it
+snapshot_pointer = db_dir / "wiki_statistics_snapshot.current"
+# Superseded snapshots are kept this long, so a reader that resolved the pointer just before a swap can finish
+GENERATION_GRACE_SECONDS = 300
+
+STATISTICS_FIELDS = ("pages", "articles", "edits", "files", "users", "active_users")
+DB_NAMES_FILE = "db_names.npy"
+
+
+class StatisticsSnapshot:
+    """
+    Columnar copy of the wiki_statistics table. Every field in STATISTICS_FIELDS is an int64 array
+    whose rows line up with db_names, so aggregations can run on whole columns at once.
+    """
+
+    def __init__(self, db_names: np.ndarray, columns: dict[str, np.ndarray]):
+        self.db_names = db_names
+        self.columns = columns
+        self._index: dict[str, int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.db_names)
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.columns[field]
+
+    @property
+    def index(self) -> dict[str, int]:
+        if self._index is None:
+            self._index = dict((str(db_name), row) for row, db_name in enumerate(self.db_names))
+        return self._index
+
+    def get(self, db_name: str, field: str) -> int | None:
+        row = self.index.get(db_name)
+        if row is None:
+            return None
+        return int(self.columns[field][row])
+
+    def to_dict(self, field: str) -> dict[str, int]:
+        return dict(zip(self.db_names.tolist(), self.columns[field].tolist()))
+
+    def select(self, db_names: Iterable[str]) -> np.ndarray:
+        """
+        Boolean mask of the rows belonging to the given wikis.
+        """
+        # Not cast to the dtype of db_names: its fixed width would truncate longer names into false matches
+        return np.isin(self.db_names, list(db_names))
+
+    def histogram(self, field: str, mask: np.ndarray | None = None) -> dict[int, int]:
+        """
+        Number of wikis for each distinct value of a field.
+        """
+        column = self.columns[field]
+        if mask is not None:
+            column = column[mask]
+        values, counts = np.unique(column, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def ranks(self, field: str) -> np.ndarray:
+        """
+        1-based rank of every row by a field, highest value first. Ties share the best rank.
+        """
+        column = self.columns[field]
+        sorted_desc = np.sort(column)[::-1]
+        return np.searchsorted(-sorted_desc, -column, side="left") + 1
+
+
+def build_statistics_snapshot(stats: dict[str, WikiSiteStatistics | None]) -> StatisticsSnapshot:
+    db_names: list[str] = []
+    rows: list[list[int]] = []
+    for db_name, v in stats.items():
+        if v is None:
+            continue
+        row = []
+        for field in STATISTICS_FIELDS:
+            num = getattr(v, field, None)
+            # Older rows were stored before "images" was renamed to "files"
+            if num is None and field == 'files':
+                num = getattr(v, 'images', None)
+            assert num is not None, f"{db_name} has no {field} statistic"
+            row.append(num)
+        db_names.append(db_name)
+        rows.append(row)
+    table = np.array(rows, dtype=np.int64).reshape(len(rows), len(STATISTICS_FIELDS))
+    columns = dict((field, np.ascontiguousarray(table[:, i])) for i, field in enumerate(STATISTICS_FIELDS))
+    return StatisticsSnapshot(np.array(db_names, dtype=str), columns)
+
+
+def export_statistics_snapshot(stats: dict[str, WikiSiteStatistics | None], pointer: Path = snapshot_pointer) -> Path:
+    """
+    Write the numeric site statistics as one .npy file per column into a directory of their own, then
+    publish it by atomically replacing the pointer file with one that names it. Readers see either the
+    previous snapshot or the new one, and concurrent writers never touch each other's directories.
+    """
+    snapshot = build_statistics_snapshot(stats)
+    directory = Path(tempfile.mkdtemp(prefix=generation_prefix(pointer), dir=pointer.parent))
+    np.save(directory / DB_NAMES_FILE, snapshot.db_names)
+    for field, column in snapshot.columns.items():
+        np.save(directory / f"{field}.npy", column)
+    previous = current_generation(pointer)
+    fd, tmp_pointer = tempfile.mkstemp(prefix=pointer.name + ".", suffix=".tmp", dir=pointer.parent)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(directory.name)
+    os.replace(tmp_pointer, pointer)
+    if previous is not None and previous.exists():
+        # Its grace period starts now that it is superseded
+        os.utime(previous)
+    remove_stale_generations(pointer)
+    return directory
+
+
+def generation_prefix(pointer: Path) -> str:
+    return pointer.stem + "."
+
+
+def current_generation(pointer: Path = snapshot_pointer) -> Path | None:
+    try:
+        return pointer.parent / pointer.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+
+
+def remove_stale_generations(pointer: Path) -> None:
+    """
+    Delete the snapshots superseded more than GENERATION_GRACE_SECONDS ago.
+    """
+    current = current_generation(pointer)
+    cutoff = time.time() - GENERATION_GRACE_SECONDS
+    for directory in pointer.parent.glob(generation_prefix(pointer) + "*"):
+        if not directory.is_dir() or directory == current:
+            continue
+        try:
+            if directory.stat().st_mtime < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+        except FileNotFoundError:
+            # Removed by another writer
+            pass
+
+
+def load_statistics_snapshot(pointer: Path = snapshot_pointer) -> StatisticsSnapshot:
+    """
+    Memory-map the published snapshot. The pointer is resolved once, so every column comes from the
+    same snapshot. Snapshots are only written by the site statistics scan; until one has been published,
+    the snapshot is built in memory from the wiki_statistics table without scanning or exporting.
+    """
+    directory = current_generation(pointer)
+    if directory is None:
+        logger.warning(f"No statistics snapshot has been published at {pointer}. "
+                       f"Reading the wiki_statistics table instead; run a statistics scan to publish one.")
+        return build_statistics_snapshot(get_wiki_site_statistics(read_only=True))
+    db_names = np.load(directory / DB_NAMES_FILE, mmap_mode="r")
+    columns = dict((field, np.load(directory / f"{field}.npy", mmap_mode="r")) for field in STATISTICS_FIELDS)
+    return StatisticsSnapshot(db_names, columns)